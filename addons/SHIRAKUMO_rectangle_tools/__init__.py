@@ -1,5 +1,8 @@
 import bpy
 from . import tools
+from . import batch
+from . import tilemap
+from . import profiling
 
 bl_info = {
     "name": "Rectangle Tools",
@@ -16,8 +19,14 @@ bl_info = {
 
 def register():
     tools.register()
+    batch.register()
+    tilemap.register()
+    profiling.register()
 
 def unregister():
+    profiling.unregister()
+    tilemap.unregister()
+    batch.unregister()
     tools.unregister()
     
 if __name__ == "__main__":
@@ -0,0 +1,52 @@
+import numpy as np
+
+## Vectorized counterparts to the scalar helpers in mesh and tools. Points
+## are (N,3) float arrays, matrices anything numpy can turn into a 4x4.
+
+def mesh_coords(data):
+    co = np.empty(len(data.vertices)*3, dtype=np.float32)
+    data.vertices.foreach_get('co', co)
+    return co.reshape(-1,3)
+
+def mesh_edges(data):
+    edges = np.empty(len(data.edges)*2, dtype=np.int32)
+    data.edges.foreach_get('vertices', edges)
+    return edges.reshape(-1,2)
+
+def mesh_arrays(data):
+    return mesh_coords(data), mesh_edges(data)
+
+def set_mesh_coords(data, co):
+    data.vertices.foreach_set('co', np.ascontiguousarray(co, dtype=np.float32).ravel())
+    data.update()
+
+def mesh_selection(data):
+    sel = np.empty(len(data.vertices), dtype=bool)
+    data.vertices.foreach_get('select', sel)
+    return sel
+
+def transform(matrix, points):
+    m = np.asarray(matrix, dtype=np.float64)
+    return points @ m[:3,:3].T + m[:3,3]
+
+def line_factors(p, a, b, clamp=False):
+    s = np.broadcast_to(b - a, np.shape(p))
+    w = p - a
+    l2 = np.einsum('ij,ij->i', s, s)
+    f = np.einsum('ij,ij->i', w, s) / np.where(l2 == 0.0, 1.0, l2)
+    if clamp:
+        f = np.clip(f, 0.0, 1.0)
+    return f
+
+def line_snaps(p, a, b, clamp=False):
+    return a + line_factors(p, a, b, clamp)[:,None] * (b - a)
+
+def line_distances(p, a, b, clamp=True):
+    return np.linalg.norm(line_snaps(p, a, b, clamp) - p, axis=1)
+
+def snap_to_grid(points, grid=0.1, basis=np.identity(4)):
+    if grid == 0.0:
+        return points
+    basis = np.asarray(basis, dtype=np.float64)
+    local = transform(np.linalg.pinv(basis), points)
+    return transform(basis, np.round(local / grid) * grid)
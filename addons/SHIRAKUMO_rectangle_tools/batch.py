@@ -0,0 +1,192 @@
+import bpy
+import csv
+import io
+import json
+import time
+from mathutils import Vector
+from .mesh import session
+
+## A rectangle spec is a dict of the form
+##   {"edge": 12, "start": [x,y,z], "end": [x,y,z]}
+## where EDGE is optional and refers to the edge index in the mesh as it was
+## before the batch was applied. All coordinates are in object local space.
+## In CSV form the columns are edge,sx,sy,sz,ex,ey,ez with an empty or
+## negative edge for no edge. Specs are only normalized when they are drawn,
+## so that a bad one fails on its own rather than the whole batch.
+
+def parse_specs(text, format='JSON'):
+    if format == 'JSON':
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get("rectangles", [])
+        return list(data)
+    elif format == 'CSV':
+        specs = []
+        for row in csv.reader(io.StringIO(text)):
+            if not row or row[0].strip().startswith('#'):
+                continue
+            try:
+                float(row[1])
+            except ValueError:
+                ## Header row
+                continue
+            edge = row[0].strip()
+            specs.append({
+                "edge": edge or None,
+                "start": row[1:4],
+                "end": row[4:7],
+            })
+        return specs
+    raise ValueError(f"Unknown spec format {format}")
+
+def normalize_spec(spec):
+    if isinstance(spec, (list, tuple)):
+        spec = {"edge": spec[0], "start": spec[1], "end": spec[2]}
+    edge = spec.get("edge")
+    if edge is not None:
+        if isinstance(edge, float) and not edge.is_integer():
+            raise ValueError(f"Edge index {edge} is not an integer")
+        edge = int(edge)
+        if edge < 0:
+            edge = None
+    start = Vector([ float(x) for x in spec["start"] ])
+    end = Vector([ float(x) for x in spec["end"] ])
+    if len(start) != 3 or len(end) != 3:
+        raise ValueError("Start and end need three coordinates")
+    return {
+        "edge": edge,
+        "start": start,
+        "end": end,
+    }
+
+def load_specs(filepath):
+    format = 'CSV' if filepath.lower().endswith('.csv') else 'JSON'
+    with open(filepath, 'r') as f:
+        return parse_specs(f.read(), format)
+
+def draw_rectangles(object, specs, dissolve_verts=True, select=True):
+    ## Applies all SPECS to OBJECT in a single bmesh session with one sync,
+    ## and returns a report of the per rectangle results and throughput.
+    normalized = []
+    for spec in specs:
+        try:
+            normalized.append((normalize_spec(spec), None))
+        except KeyError as e:
+            normalized.append((None, f"Spec is missing {e}"))
+        except (AttributeError, IndexError, TypeError, ValueError) as e:
+            normalized.append((None, f"Invalid spec: {e}"))
+    mt = session(object)
+    mesh = mt.mesh
+    ## Resolve edges up front, as indices shift once we start editing.
+    edges = [ mesh.edges[spec["edge"]] if spec is not None and spec["edge"] is not None and spec["edge"] < len(mesh.edges) else None
+              for spec,_ in normalized ]
+    results = []
+    created = []
+    begin = time.perf_counter()
+    for i,((spec,error),edge) in enumerate(zip(normalized, edges)):
+        t = time.perf_counter()
+        try:
+            if error is not None:
+                ## Reported as is.
+                pass
+            elif spec["edge"] is not None and edge is None:
+                error = f"No edge with index {spec['edge']}"
+            elif edge is not None and not edge.is_valid:
+                error = f"Edge {spec['edge']} was removed by an earlier rectangle"
+            else:
+                ## Earlier rectangles may have split the edge, in which case
+                ## we need the part that the start now lies on.
+                if edge is not None:
+                    edge = mt.closest_connected_edge(edge, spec["start"])
+                res = mt.create_rect(edge, spec["start"], spec["end"], dissolve_verts=dissolve_verts)
+                if res is None:
+                    error = "Degenerate rectangle"
+                elif res[1] is not None:
+                    created.append(res[1])
+        except Exception as e:
+            error = str(e)
+        results.append({
+            "index": i,
+            "ok": error is None,
+            "error": error,
+            "seconds": time.perf_counter() - t,
+        })
+    if select and created:
+        mt.select([ e for es in created for e in (es if hasattr(es, '__iter__') else [es]) if e.is_valid ])
+    mt.sync()
+    total = time.perf_counter() - begin
+    ok = sum(1 for r in results if r["ok"])
+    return {
+        "object": object.name,
+        "count": len(results),
+        "ok": ok,
+        "failed": len(results) - ok,
+        "seconds": total,
+        "rects_per_second": len(results) / total if 0 < total else 0.0,
+        "results": results,
+    }
+
+class SHIRAKUMO_RECT_OT_draw_rectangles(bpy.types.Operator):
+    bl_idname = "mesh.draw_rectangles"
+    bl_label = "Draw rectangles"
+    bl_options = {'REGISTER', 'UNDO'}
+    bl_description = "Draw a batch of rectangles from a JSON or CSV spec"
+    last_report = None
+
+    filepath: bpy.props.StringProperty(
+        name="File",
+        subtype="FILE_PATH",
+        description="JSON or CSV file with the rectangle specs")
+    specs: bpy.props.StringProperty(
+        name="Specs",
+        options=set(['HIDDEN','SKIP_SAVE']),
+        description="Inline JSON rectangle specs, used if no file is given")
+    report_path: bpy.props.StringProperty(
+        name="Report",
+        subtype="FILE_PATH",
+        description="Optional JSON file to write the batch report to")
+    dissolve_verts: bpy.props.BoolProperty(
+        name="Dissolve Verts",
+        default=True, options=set(),
+        description="Whether to dissolve superfluous vertices on the extruded edges")
+
+    @classmethod
+    def poll(cls, context):
+        return (context.object is not None and context.object.type == 'MESH')
+
+    def execute(self, context):
+        try:
+            if self.filepath:
+                specs = load_specs(bpy.path.abspath(self.filepath))
+            else:
+                specs = parse_specs(self.specs or "[]")
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            self.report({'ERROR'}, f"Failed to read rectangle specs: {e}")
+            return {'CANCELLED'}
+        report = draw_rectangles(context.object, specs, dissolve_verts=self.dissolve_verts)
+        SHIRAKUMO_RECT_OT_draw_rectangles.last_report = report
+        if self.report_path:
+            with open(bpy.path.abspath(self.report_path), 'w') as f:
+                json.dump(report, f, indent=2)
+        level = {'WARNING'} if report["failed"] else {'INFO'}
+        self.report(level, "Drew %i of %i rectangles in %.3fs (%.1f/s)" % (
+            report["ok"], report["count"], report["seconds"], report["rects_per_second"]))
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        if self.filepath or self.specs:
+            return self.execute(context)
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+registered_classes = [
+    SHIRAKUMO_RECT_OT_draw_rectangles,
+]
+
+def register():
+    for cls in registered_classes:
+        bpy.utils.register_class(cls)
+
+def unregister():
+    for cls in registered_classes:
+        bpy.utils.unregister_class(cls)
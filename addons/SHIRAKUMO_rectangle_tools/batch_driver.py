@@ -0,0 +1,205 @@
+## Applies rectangle specs to many .blend files in parallel. Run with
+##   python batch_driver.py manifest.json [options]
+## The manifest is a JSON list of jobs of the form
+##   {"blend": "maps/a.blend", "object": "Map", "specs": "a.json", "output": "out/a.blend"}
+## where SPECS is a JSON or CSV spec file as for mesh.draw_rectangles, or an
+## inline list of specs, and OUTPUT is optional and defaults to saving the
+## file in place. Relative paths are relative to the manifest.
+##
+## Jobs are grouped by blend file, and every file is handled by one
+## blender --background worker process that applies all of its jobs through
+## batch.draw_rectangles and saves once. Up to --jobs workers run at a time.
+## See --help for the options.
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+def load_manifest(path):
+    with open(path) as f:
+        jobs = json.load(f)
+    if isinstance(jobs, dict):
+        jobs = jobs.get("jobs", [])
+    base = os.path.dirname(os.path.abspath(path))
+    def resolve(p):
+        return p if p is None or os.path.isabs(p) else os.path.normpath(os.path.join(base, p))
+    for i,job in enumerate(jobs):
+        job["index"] = i
+        job["blend"] = resolve(job["blend"])
+        job["output"] = resolve(job.get("output"))
+        if isinstance(job.get("specs"), str):
+            job["specs"] = resolve(job["specs"])
+    return jobs
+
+def group_jobs(jobs):
+    ## Jobs on the same file have to run in the same worker, one after the
+    ## other, and agree on where the file goes.
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job["blend"], []).append(job)
+    for blend, group in groups.items():
+        outputs = set(job["output"] for job in group if job["output"] is not None)
+        if 1 < len(outputs):
+            raise ValueError(f"Conflicting outputs for {blend}: {', '.join(sorted(outputs))}")
+    return groups
+
+def failed(job, error):
+    return {
+        "index": job["index"],
+        "blend": job["blend"],
+        "object": job.get("object"),
+        "ok": False,
+        "error": error,
+        "count": 0,
+        "failed": 0,
+        "seconds": 0.0,
+    }
+
+def run_file(blender, blend, group, timeout, save):
+    ## Runs one worker over all jobs of a blend file and returns its file
+    ## entry and per job results.
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="rectangles-") as tmp:
+        jobs_path = os.path.join(tmp, "jobs.json")
+        result_path = os.path.join(tmp, "result.json")
+        with open(jobs_path, "w") as f:
+            json.dump({"jobs": group, "save": save}, f)
+        command = [blender, "--background", "--factory-startup", blend,
+                   "--python", os.path.abspath(__file__),
+                   "--", "--worker", jobs_path, "--result", result_path]
+        entry = {"blend": blend, "jobs": len(group), "returncode": None, "error": None}
+        results = None
+        try:
+            proc = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+            entry["returncode"] = proc.returncode
+            if os.path.exists(result_path):
+                with open(result_path) as f:
+                    data = json.load(f)
+                results = data["results"]
+                entry["error"] = data.get("error")
+            else:
+                entry["error"] = (proc.stderr or proc.stdout or "Worker produced no result").strip()[-2000:]
+        except subprocess.TimeoutExpired:
+            entry["error"] = f"Timed out after {timeout}s"
+        except OSError as e:
+            entry["error"] = f"Failed to run {blender}: {e}"
+    entry["seconds"] = time.perf_counter() - start
+    if results is None:
+        results = [ failed(job, entry["error"]) for job in group ]
+    return entry, results
+
+def run(args):
+    jobs = load_manifest(args.manifest)
+    groups = group_jobs(jobs)
+    start = time.perf_counter()
+    files = []
+    results = []
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [ pool.submit(run_file, args.blender, blend, group, args.timeout, not args.dry_run)
+                    for blend, group in groups.items() ]
+        for future in futures:
+            entry, res = future.result()
+            print(f"{'ok' if entry['error'] is None else 'FAILED':>6} {entry['seconds']:8.2f}s {entry['blend']}", flush=True)
+            files.append(entry)
+            results.extend(res)
+    results.sort(key=lambda r: r["index"])
+    ok = sum(1 for r in results if r["ok"])
+    return {
+        "manifest": os.path.abspath(args.manifest),
+        "workers": args.jobs,
+        "files": len(files),
+        "count": len(results),
+        "ok": ok,
+        "failed": len(results) - ok,
+        "seconds": time.perf_counter() - start,
+        "file_results": files,
+        "results": results,
+    }
+
+## Worker side, running inside Blender.
+
+def run_worker(jobs_path, result_path):
+    import bpy
+    sys.path.insert(0, os.path.dirname(here))
+    package = os.path.basename(here)
+    batch = importlib.import_module(package + ".batch")
+    mesh = importlib.import_module(package + ".mesh")
+    with open(jobs_path) as f:
+        data = json.load(f)
+    results = []
+    error = None
+    output = None
+    for job in data["jobs"]:
+        start = time.perf_counter()
+        output = job["output"] or output
+        try:
+            object = bpy.data.objects.get(job["object"])
+            if object is None or object.type != 'MESH':
+                raise ValueError(f"No mesh object named {job['object']}")
+            specs = job["specs"]
+            if isinstance(specs, str):
+                specs = batch.load_specs(specs)
+            report = batch.draw_rectangles(object, specs, dissolve_verts=job.get("dissolve_verts", True))
+            results.append({
+                "index": job["index"],
+                "blend": job["blend"],
+                "object": job["object"],
+                "ok": report["failed"] == 0,
+                "error": None if report["failed"] == 0 else f"{report['failed']} of {report['count']} rectangles failed",
+                "count": report["count"],
+                "failed": report["failed"],
+                "seconds": time.perf_counter() - start,
+                "report": report,
+            })
+        except Exception as e:
+            results.append(dict(failed(job, str(e)), seconds=time.perf_counter() - start))
+    mesh.release_sessions()
+    if data["save"]:
+        try:
+            if output is None:
+                bpy.ops.wm.save_mainfile()
+            else:
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+                bpy.ops.wm.save_as_mainfile(filepath=output)
+        except Exception as e:
+            error = f"Failed to save: {e}"
+            for r in results:
+                r["ok"] = False
+                r["error"] = r["error"] or error
+    with open(result_path, "w") as f:
+        json.dump({"results": results, "error": error}, f)
+
+def main(argv):
+    if "--worker" in argv:
+        parser = argparse.ArgumentParser(prog="batch_driver")
+        parser.add_argument("--worker", required=True)
+        parser.add_argument("--result", required=True)
+        args = parser.parse_args(argv)
+        return run_worker(args.worker, args.result)
+    parser = argparse.ArgumentParser(prog="batch_driver", description="Apply rectangle specs to many .blend files in parallel.")
+    parser.add_argument("manifest")
+    parser.add_argument("--jobs", default=os.cpu_count() or 1, type=int,
+                        help="Number of Blender processes to run at once, one per core by default")
+    parser.add_argument("--blender", default=os.environ.get("BLENDER", "blender"))
+    parser.add_argument("--timeout", default=None, type=float,
+                        help="Seconds after which a file's worker is killed")
+    parser.add_argument("--report", default="batch_report.json")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Apply the specs but don't save any files")
+    args = parser.parse_args(argv)
+    report = run(args)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Applied {report['ok']} of {report['count']} jobs on {report['files']} files in {report['seconds']:.2f}s, wrote {args.report}")
+    if report["failed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[sys.argv.index("--")+1:] if "--" in sys.argv else sys.argv[1:])
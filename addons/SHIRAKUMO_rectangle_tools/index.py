@@ -0,0 +1,334 @@
+import math
+import threading
+import time
+import numpy as np
+from mathutils.kdtree import KDTree
+from mathutils.bvhtree import BVHTree
+from mathutils.geometry import intersect_point_line
+from . import profiling
+
+def segment_distance(p, a, b):
+    if a == b:
+        return (p-a).length
+    x,f = intersect_point_line(p, a, b)
+    if f < 0.0:
+        x = a
+    elif 1.0 < f:
+        x = b
+    return (p-x).length
+
+class Index():
+    ## Base for spatial indices over mesh elements. The accelerated structure
+    ## is only rebuilt once enough elements have changed, until then changed
+    ## elements are kept in a small overlay that is scanned linearly. Every
+    ## query pays for that scan, so the structure is rebuilt once the overlay
+    ## grows past the square root of the index size, or MIN_OVERLAY for small
+    ## indices.
+    min_overlay = 64
+
+    def __init__(self):
+        self.tree = None
+        self.size = 0
+        self.stale = set()
+        self.overlay = {}
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.updates = 0
+        ## State of a background build, see rebuild_async.
+        self.building = None
+        self.changed = set()
+        self.build_time = 0.0
+
+    def elements(self, mesh):
+        raise NotImplementedError()
+
+    def entry(self, element):
+        raise NotImplementedError()
+
+    def distance(self, entry, point):
+        raise NotImplementedError()
+
+    def build(self, mesh):
+        raise NotImplementedError()
+
+    @staticmethod
+    def build_arrays(*arrays):
+        ## Builds the tree from plain arrays. This must not touch Blender
+        ## data, as it runs on a worker thread.
+        raise NotImplementedError()
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "stale": len(self.stale),
+            "overlay": len(self.overlay),
+            "hits": self.hits,
+            "misses": self.misses,
+            "rebuilds": self.rebuilds,
+            "updates": self.updates,
+            "building": self.building is not None,
+            "build_time": self.build_time,
+        }
+
+    def churned(self):
+        return max(self.min_overlay, math.sqrt(self.size)) < len(self.stale) + len(self.overlay)
+
+    def covers(self, count):
+        ## Whether the index accounts for all elements of a mesh with COUNT
+        ## elements, meaning every added or removed one is known to us.
+        lo, hi = min(count, self.size), max(count, self.size)
+        return all(i in self.overlay or i in self.stale for i in range(lo, hi))
+
+    def rebuild(self, mesh):
+        elements = self.elements(mesh)
+        elements.ensure_lookup_table()
+        self.size = len(elements)
+        self.tree = self.build(mesh)
+        self.building = None
+        self.stale.clear()
+        self.overlay.clear()
+        self.rebuilds += 1
+
+    def reset(self):
+        ## Drops the tree and any build in progress.
+        self.tree = None
+        self.size = 0
+        self.building = None
+        self.stale.clear()
+        self.overlay.clear()
+
+    def adopt(self, tree, size):
+        ## Takes over a TREE built elsewhere over SIZE elements.
+        self.tree = tree
+        self.size = size
+        self.stale.clear()
+        self.overlay.clear()
+        self.rebuilds += 1
+        return self
+
+    def rebuild_async(self, size, *arrays):
+        ## Builds the tree over a snapshot of SIZE elements on a worker
+        ## thread. Until poll swaps it in, queries are answered by the
+        ## current tree if there is one, and edits are remembered so that
+        ## they can be replayed onto the new tree. The result is kept on the
+        ## thread, so a superseded build can't overwrite a newer one.
+        self.changed = set()
+        def work():
+            start = time.perf_counter()
+            tree = self.build_arrays(*arrays)
+            thread.result = (tree, size, time.perf_counter() - start)
+        thread = threading.Thread(target=work, daemon=True)
+        thread.result = None
+        self.building = thread
+        thread.start()
+        return self
+
+    def poll(self, mesh=None):
+        ## Swaps in the result of a finished background build. Returns
+        ## whether one was swapped in.
+        thread = self.building
+        if thread is None or thread.result is None:
+            return False
+        tree, size, self.build_time = thread.result
+        changed = self.changed
+        self.building = None
+        self.changed = set()
+        self.adopt(tree, size)
+        profiling.record("index_build", self.build_time)
+        if mesh is not None and changed:
+            elements = self.elements(mesh)
+            elements.ensure_lookup_table()
+            for i in changed:
+                self.invalidate(elements, i)
+        return True
+
+    def wait(self, mesh=None):
+        if self.building is not None:
+            self.building.join()
+            self.poll(mesh)
+        return self
+
+    def update(self, mesh, changed):
+        ## CHANGED is an iterable of element indices that were created or
+        ## changed. Indices past the end are treated as removed elements.
+        if self.building is not None:
+            self.changed.update(changed)
+            if self.tree is None:
+                return
+        elif self.tree is None:
+            return self.rebuild(mesh)
+        elements = self.elements(mesh)
+        elements.ensure_lookup_table()
+        for i in changed:
+            self.invalidate(elements, i)
+        self.updates += 1
+        if self.building is None and self.churned():
+            self.rebuild(mesh)
+
+    def invalidate(self, elements, i):
+        if i < self.size:
+            self.stale.add(i)
+        if i < len(elements):
+            self.overlay[i] = self.entry(elements[i])
+        else:
+            self.overlay.pop(i, None)
+
+    def query(self, point, n):
+        raise NotImplementedError()
+
+    def find_n(self, point, n, mesh=None):
+        ## Returns up to N (index, distance) pairs sorted by distance. If MESH
+        ## is passed the results are verified against the current geometry,
+        ## so elements that were moved behind our back fix themselves.
+        self.poll(mesh)
+        while True:
+            if self.tree is None:
+                return []
+            found = self.query(point, n)
+            for i,e in self.overlay.items():
+                found.append((i, self.distance(e, point)))
+            found.sort(key=lambda x: x[1])
+            found = found[:n]
+            if mesh is not None:
+                elements = self.elements(mesh)
+                moved = [ i for i,d in found if i not in self.overlay and self.moved(elements, i, d, point) ]
+                if moved:
+                    for i in moved:
+                        self.invalidate(elements, i)
+                        self.misses += 1
+                    if self.building is not None:
+                        self.changed.update(moved)
+                    if self.building is None and self.churned():
+                        self.rebuild(mesh)
+                    continue
+            self.hits += 1
+            return found
+
+    def find(self, point, mesh=None):
+        found = self.find_n(point, 1, mesh)
+        return found[0][0] if found else None
+
+    def moved(self, elements, i, d, point):
+        if len(elements) <= i:
+            return True
+        return 1e-5 < abs(self.distance(self.entry(elements[i]), point) - d)
+
+class PointIndex(Index):
+    ## Index over one point per element, in a KD-tree.
+    def distance(self, entry, point):
+        return (entry-point).length
+
+    def build(self, mesh):
+        elements = self.elements(mesh)
+        kd = KDTree(len(elements))
+        for i,x in enumerate(elements):
+            kd.insert(self.entry(x), i)
+        kd.balance()
+        return kd
+
+    @staticmethod
+    def build_arrays(points):
+        kd = KDTree(len(points))
+        for i,p in enumerate(points.tolist()):
+            kd.insert(p, i)
+        kd.balance()
+        return kd
+
+    def query(self, point, n):
+        ## Stale entries can crowd out the real results, so ask for more
+        ## until we have enough or the tree is exhausted.
+        k = n
+        while True:
+            res = self.tree.find_n(point, k)
+            found = [ (i,d) for co,i,d in res if i not in self.stale ]
+            if n <= len(found) or len(res) < k:
+                return found[:n]
+            k *= 2
+
+class FaceIndex(PointIndex):
+    ## Index over face median centers.
+    def elements(self, mesh):
+        return mesh.faces
+
+    def entry(self, face):
+        return face.calc_center_median()
+
+class VertIndex(PointIndex):
+    ## Index over vertex positions, for snapping.
+    def elements(self, mesh):
+        return mesh.verts
+
+    def entry(self, vert):
+        return vert.co.copy()
+
+class MidpointIndex(PointIndex):
+    ## Index over edge midpoints, for snapping.
+    def elements(self, mesh):
+        return mesh.edges
+
+    def entry(self, edge):
+        return (edge.verts[0].co + edge.verts[1].co) / 2
+
+class EdgeIndex(Index):
+    ## Index over edge segments, stored as degenerate triangles in BVHs so
+    ## that nearest queries return the exact distance to the segment. The
+    ## edges are split into chunks of their own BVH each, as building one
+    ## holds on to the GIL throughout, which would stall the UI for as long
+    ## as a background build over a large mesh takes. Queries ask every
+    ## chunk, which costs little next to the Python around them.
+    chunk_size = 16384
+
+    def elements(self, mesh):
+        return mesh.edges
+
+    def entry(self, edge):
+        return (edge.verts[0].co.copy(), edge.verts[1].co.copy())
+
+    def distance(self, entry, point):
+        return segment_distance(point, *entry)
+
+    def build(self, mesh):
+        mesh.verts.index_update()
+        co = np.array([ v.co for v in mesh.verts ], dtype=np.float64).reshape(-1,3)
+        edges = np.array([ (e.verts[0].index, e.verts[1].index) for e in mesh.edges ], dtype=np.int64).reshape(-1,2)
+        return self.build_arrays(co, edges)
+
+    @staticmethod
+    def build_arrays(co, edges):
+        ## CO and EDGES are arrays of vertex coordinates and index pairs.
+        ## Returns a list of (first edge index, BVH) chunks.
+        chunks = []
+        for offset in range(0, len(edges), EdgeIndex.chunk_size):
+            part = edges[offset:offset+EdgeIndex.chunk_size]
+            ## Only hand the chunk's own verts to the BVH.
+            verts, tris = np.unique(part.ravel(), return_inverse=True)
+            tris = tris.reshape(-1,2)[:,[0,1,1]]
+            chunks.append((offset, BVHTree.FromPolygons(co[verts].tolist(), tris.tolist(), all_triangles=True)))
+            ## Let the main thread have the GIL between chunks.
+            time.sleep(0)
+        return chunks
+
+    def nearest(self, point):
+        best = None
+        for offset, tree in self.tree:
+            co,normal,i,d = tree.find_nearest(point)
+            if i is not None and (best is None or d < best[1]):
+                best = (i+offset, d)
+        return best
+
+    def query(self, point, n):
+        best = self.nearest(point)
+        if best is None:
+            return []
+        if n == 1 and best[0] not in self.stale:
+            return [best]
+        ## Grow the search radius until we have enough valid candidates.
+        r = max(best[1], 1e-6)
+        while True:
+            res = [ (i+offset,d) for offset, tree in self.tree
+                    for co,normal,i,d in tree.find_nearest_range(point, r) if i+offset not in self.stale ]
+            if n <= len(res) or self.size - len(self.stale) <= len(res):
+                res.sort(key=lambda x: x[1])
+                return res[:n]
+            r *= 2.0
@@ -1,10 +1,16 @@
 import math
+import bpy
 import bmesh
 import heapq
+from collections import deque
 from bpy_extras import view3d_utils
-from mathutils import Vector, Quaternion
-from mathutils.kdtree import KDTree
+from mathutils import Vector, Matrix, Quaternion
+import numpy as np
 from collections import defaultdict
+from .index import FaceIndex, EdgeIndex, VertIndex, MidpointIndex
+from .topology import Topology
+from .arrays import mesh_arrays
+from . import profiling
 
 def line_rotation(a,b):
     dir = (b-a).normalized()
@@ -56,6 +62,25 @@ def edge_between(a, b):
             return e
     return None
 
+def mesh_fingerprint(data, arrays=None):
+    ## Cheap identity of a Mesh datablock's geometry, so that we can tell
+    ## whether an object mode copy of it is still current.
+    co, ev = mesh_arrays(data) if arrays is None else arrays
+    return (len(data.vertices), len(data.edges), len(data.polygons), hash(co.tobytes()), hash(ev.tobytes()))
+
+def face_frame(face):
+    ## Orthonormal basis on FACE, with Z along its normal and X along its
+    ## longest edge, placed at that edge's first vert.
+    edge = max(face.edges, key=lambda e: e.calc_length())
+    normal = face.normal.normalized()
+    tangent = edge_dir(edge)
+    tangent = (tangent - normal*normal.dot(tangent)).normalized()
+    if tangent.length_squared == 0.0 or normal.length_squared == 0.0:
+        return None
+    frame = Matrix((tangent, normal.cross(tangent), normal)).transposed().to_4x4()
+    frame.translation = edge.verts[0].co
+    return frame
+
 def plane_snap(origin, normal, p):
     return p-normal*normal.dot(p-origin)
 
@@ -76,47 +101,466 @@ class FakeEdge:
             b = a+Vector([1,0,0])
         self.verts = [FakeVert(a), FakeVert(b)]
 
+index_classes = {
+    'faces': FaceIndex,
+    'edges': EdgeIndex,
+    'verts': VertIndex,
+    'midpoints': MidpointIndex,
+}
+
+def index_arrays(kind, co, edges, centers=None):
+    ## The element count and build arrays of an index of KIND over a
+    ## snapshot of the mesh.
+    if kind == 'edges':
+        return (len(edges), co, edges)
+    if kind == 'verts':
+        return (len(co), co)
+    if kind == 'midpoints':
+        return (len(edges), (co[edges[:,0]] + co[edges[:,1]]) / 2)
+    return (len(centers), centers)
+
+class ViewEdge(FakeEdge):
+    ## Stands in for a BMEdge of a MeshView in hover queries.
+    def __init__(self, view, index):
+        a,b = view.edges[index]
+        super().__init__(Vector(view.co[a]), Vector(view.co[b]))
+        self.view = view
+        self.index = index
+        self.link_faces = []
+
+    @property
+    def is_valid(self):
+        return self.view.valid
+
+    def calc_length(self):
+        return (self.verts[1].co-self.verts[0].co).length
+
+    def __eq__(self, other):
+        return isinstance(other, ViewEdge) and self.view is other.view and self.index == other.index
+
+class MeshView():
+    ## Read-only arrays of an object mode mesh, which is all that hovering
+    ## needs. The spatial indices over them are built on first use and never
+    ## updated, as edits always go through a bmesh.
+    def __init__(self, co, edges):
+        self.co = co
+        self.edges = edges
+        self.valid = True
+        self.indices = {}
+
+    def index(self, kind):
+        ## Indices are built in the background, and answer no queries until
+        ## they are ready.
+        index = self.indices.get(kind)
+        if index is None:
+            index = self.indices[kind] = index_classes[kind]()
+            index.rebuild_async(*index_arrays(kind, self.co, self.edges))
+        index.poll()
+        return index
+
+    def entry(self, kind, i):
+        if kind == 'verts':
+            return Vector(self.co[i])
+        if kind == 'midpoints':
+            a,b = self.edges[i]
+            return (Vector(self.co[a]) + Vector(self.co[b])) / 2
+        return ViewEdge(self, i)
+
 class MeshTools():
     def __init__(self, object):
         self.object = object
-        self.mesh = None
+        ## In object mode only the array view is read until something needs
+        ## the bmesh, see the mesh property.
+        self.bm = None
+        self.view = None
+        self.indices = { kind: cls() for kind, cls in index_classes.items() }
+        self.dirty = set()
+        self.modified = False
+        self.fingerprint = None
+        ## The topology kernel is built lazily and tracks edits through the
+        ## verts touched or created since it was last brought up to date.
+        self.topology = None
+        self.pending = set()
+        self.created = set()
+        ## Set while a modal operator keeps references into the bmesh, during
+        ## which the session must not be refreshed from under it.
+        self.held = False
+        ## Orientation frames of faces by index, computed on demand and
+        ## dropped for the faces an edit touches.
+        self.frames = {}
+        ## Bumped whenever the geometry we hand out may have changed.
+        self.version = 0
+        ## The session version that the depsgraph update caused by our last
+        ## edit mode sync will result in, see refresh.
+        self.synced = None
         self.refresh()
 
-    def refresh(self):
-        if self.mesh is not None:
-            self.mesh.free()
-        if self.object.data.is_editmode:
-            self.mesh = bmesh.from_edit_mesh(self.object.data)
+    def refresh(self, full=False):
+        with profiling.phase("refresh"):
+            data = self.object.data
+            if data.is_editmode:
+                ## The indices and the topology kernel are only up to date if
+                ## the geometry change came from our own sync. Anything else,
+                ## like moving verts around with G, keeps the element counts
+                ## but not the positions we indexed.
+                if session_version(self.object)[:2] != self.synced:
+                    full = True
+            self.synced = None
+            if self.modified:
+                self.sync()
+            if data.is_editmode:
+                ## The wrapped edit mesh is live, but our python references to
+                ## it do not survive other operators, so always re-wrap.
+                self.drop_view()
+                if self.bm is not None:
+                    self.bm.free()
+                self.bm = bmesh.from_edit_mesh(data)
+                self.fingerprint = None
+            else:
+                arrays = mesh_arrays(data)
+                fingerprint = mesh_fingerprint(data, arrays)
+                if (full or fingerprint != self.fingerprint or (self.bm is None and self.view is None)
+                    or (self.bm is not None and (self.bm.is_wrapped or not self.bm.is_valid))):
+                    if self.bm is not None:
+                        self.bm.free()
+                        self.bm = None
+                    self.drop_view()
+                    self.view = MeshView(*arrays)
+                    full = True
+                self.fingerprint = fingerprint
+            if self.bm is not None:
+                self.bm.verts.ensure_lookup_table()
+                self.bm.faces.ensure_lookup_table()
+                self.bm.edges.ensure_lookup_table()
+            if data.is_editmode or full:
+                self.version += 1
+            self.update_transform()
+            if self.topology is not None:
+                ## Pending edits refer to the bmesh we just dropped.
+                if full or self.pending or (self.topology.nv, self.topology.ne) != self.counts():
+                    self.topology = None
+            self.dirty.clear()
+            self.pending.clear()
+            self.created.clear()
+            self.frames.clear()
+            for index in self.indices.values():
+                ## Indices are built lazily on the first query, so that tools
+                ## which only edit the mesh never pay for them.
+                if index.tree is None and index.building is None:
+                    continue
+                if full or (self.bm is not None and not index.covers(len(index.elements(self.bm)))):
+                    ## Rebuilt in the background on the next query.
+                    index.reset()
+
+    @property
+    def mesh(self):
+        ## Materializes the bmesh of an object mode session on first use.
+        ## The view describes the same geometry, so this is no new version.
+        if self.bm is None:
+            self.bm = bmesh.new()
+            self.bm.from_mesh(self.object.data)
+            self.bm.verts.ensure_lookup_table()
+            self.bm.faces.ensure_lookup_table()
+            self.bm.edges.ensure_lookup_table()
+            ## Whatever the view already built is just as good for the bmesh,
+            ## and the indices it took over from us still are ours.
+            for kind, index in self.view.indices.items():
+                if index.tree is not None and index is not self.indices[kind]:
+                    self.indices[kind].adopt(index.tree, index.size)
+            self.view = None
+        return self.bm
+
+    def drop_view(self):
+        if self.view is not None:
+            self.view.valid = False
+            self.view = None
+
+    def is_wrapped(self):
+        return self.bm is not None and self.bm.is_wrapped
+
+    def counts(self):
+        if self.bm is None:
+            return (len(self.view.co), len(self.view.edges))
+        return (len(self.bm.verts), len(self.bm.edges))
+
+    def edge_coords(self, i):
+        ## Copies of the end points of edge I, or None if there is no such
+        ## edge, without materializing the bmesh.
+        if self.counts()[1] <= i:
+            return None
+        if self.bm is None:
+            e = ViewEdge(self.view, i)
         else:
-            self.mesh = bmesh.new()
-            self.mesh.from_mesh(self.object.data)
-        self.mesh.faces.ensure_lookup_table()
-        self.mesh.edges.ensure_lookup_table()
-        self.from_local = self.object.matrix_world
+            e = self.bm.edges[i]
+        return (e.verts[0].co.copy(), e.verts[1].co.copy())
+
+    def update_transform(self):
+        ## Indices are kept in object space, so a transform change only
+        ## affects the conversion of query points.
+        self.from_local = self.object.matrix_world.copy()
         self.to_local = self.from_local.inverted_safe()
-        self.kd = KDTree(len(self.mesh.faces))
-        for i,f in enumerate(self.mesh.faces):
-            self.kd.insert(f.calc_center_median(), i)
-        self.kd.balance()
-
-    def sync(self):
-        if self.mesh is not None:
-            bmesh.ops.recalc_face_normals(self.mesh, faces=self.mesh.faces)
+
+    def ensure_index(self, kind, wait=False):
+        ## Starts building the index of KIND from a snapshot of the mesh data
+        ## in the background if possible. Unless WAIT, the index answers no
+        ## queries until it is ready.
+        index = self.indices[kind]
+        index.poll(self.bm)
+        if index.tree is None and index.building is None:
+            arrays = self.snapshot(kind)
+            if arrays is None:
+                index.rebuild(self.mesh)
+            else:
+                index.rebuild_async(*arrays)
+        if wait:
+            index.wait(self.bm)
+        return index
+
+    def snapshot(self, kind):
+        ## Reading the mesh data through foreach_get is cheap enough for the
+        ## main thread, walking the bmesh is not. That only works while the
+        ## mesh data is not behind our bmesh, though.
+        if self.modified:
+            return None
+        if self.bm is None:
+            co, edges = self.view.co, self.view.edges
+        else:
+            if self.bm.is_wrapped:
+                self.object.update_from_editmode()
+            co, edges = mesh_arrays(self.object.data)
+        centers = None
+        if kind == 'faces':
+            polygons = self.object.data.polygons
+            centers = np.empty(len(polygons)*3, dtype=np.float32)
+            polygons.foreach_get('center', centers)
+            centers = centers.reshape(-1,3)
+        return index_arrays(kind, co, edges, centers)
+
+    def index_ready(self, kind, wait=False):
+        ## Whether hover queries on the index of KIND can be answered,
+        ## starting its build if necessary.
+        if self.bm is None:
+            index = self.view.index(kind)
+        else:
+            index = self.ensure_index(kind)
+        if wait:
+            index.wait(self.bm)
+        return index.tree is not None
+
+    def face_frame(self, face):
+        ## Entries remember their face, as indices may be reused after
+        ## removals without the face itself being touched.
+        cached = self.frames.get(face.index)
+        if cached is not None and cached[0] == face:
+            return cached[1]
+        frame = face_frame(face)
+        self.frames[face.index] = (face, frame)
+        return frame
+
+    def index_stats(self):
+        return { kind: index.stats() for kind, index in self.indices.items() }
+
+    def mark_dirty(self, verts, created=False):
+        ## Faces and edges linked to dirty verts are updated in the indices on
+        ## sync, and in the topology kernel before its next query.
+        self.dirty.update(verts)
+        self.pending.update(verts)
+        if created:
+            self.created.update(verts)
+        self.modified = True
+
+    def ensure_topology(self):
+        ## Returns the topology kernel if it can be brought up to date
+        ## cheaply, otherwise None, in which case queries walk the bmesh.
+        if self.topology is None:
+            if self.is_wrapped():
+                self.object.update_from_editmode()
+            elif self.modified:
+                ## The mesh data is behind our bmesh until the next sync.
+                return None
+            if self.bm is not None:
+                self.bm.verts.index_update()
+                self.bm.edges.index_update()
+                self.bm.verts.ensure_lookup_table()
+                self.bm.edges.ensure_lookup_table()
+            if self.bm is None:
+                self.topology = Topology(self.view.co, self.view.edges)
+            else:
+                self.topology = Topology.from_mesh(self.object.data)
+            self.pending.clear()
+            self.created.clear()
+        elif self.pending:
+            self.commit_topology()
+        return self.topology
+
+    def commit_topology(self):
+        topology = self.topology
+        mesh = self.mesh
+        mesh.verts.index_update()
+        mesh.edges.index_update()
+        mesh.verts.ensure_lookup_table()
+        mesh.edges.ensure_lookup_table()
+        created = [ v for v in self.created if v.is_valid ]
+        touched = set(v for v in self.pending if v.is_valid)
+        touched.update([ e.other_vert(v) for v in touched for e in v.link_edges ])
+        edges = set(e for v in touched for e in v.link_edges)
+        added = [ e for e in edges if topology.ne <= e.index ]
+        self.pending.clear()
+        self.created.clear()
+        ## If new elements filled holes left by removed ones, the indices of
+        ## existing elements shifted and we can't patch things up.
+        if (len(mesh.verts) != topology.nv + len(created)
+            or any(v.index < topology.nv for v in created)
+            or len(mesh.edges) != topology.ne + len(added)):
+            self.topology = None
+            return
+        ne = topology.ne
+        for v in sorted(created, key=lambda v: v.index):
+            topology.add_vertex(v.co)
+        for v in touched:
+            topology.set_co(v.index, v.co)
+        for e in sorted(added, key=lambda e: e.index):
+            topology.add_edge(e.verts[0].index, e.verts[1].index)
+        for e in edges:
+            if e.index < ne:
+                topology.set_edge(e.index, e.verts[0].index, e.verts[1].index)
+
+    def topology_edge(self, i):
+        ## Maps a kernel edge back to the bmesh, verifying that the kernel is
+        ## not stale in the process.
+        e = self.mesh.edges[i]
+        a,b = self.topology.edge_verts(i)
+        if ((e.verts[0].index, e.verts[1].index) != (a,b)
+            or (e.verts[0].co-Vector(self.topology.co[a])).length_squared > 1e-10
+            or (e.verts[1].co-Vector(self.topology.co[b])).length_squared > 1e-10):
+            self.topology = None
+            return None
+        return e
+
+    def fix_normals(self, faces):
+        ## Orient FACES consistently with their unchanged neighbours by walking
+        ## across shared edges from the region's border, rather than
+        ## recalculating the normals of the entire mesh.
+        todo = set(faces)
+        region = set(todo)
+        queue = deque()
+        def orient(f, l, o):
+            ## L is a loop of F on the same edge as O of an oriented face.
+            ## Consistent winding means they run in opposite directions.
+            if l.vert == o.vert:
+                f.normal_flip()
+            todo.discard(f)
+            queue.append(f)
+        for f in region:
+            if f not in todo:
+                continue
+            anchor = next(((l,o) for l in f.loops for o in l.link_loops if o.face not in region), None)
+            if anchor is None:
+                continue
+            orient(f, *anchor)
+            while queue:
+                g = queue.popleft()
+                for l in g.loops:
+                    for o in l.link_loops:
+                        if o.face in todo:
+                            orient(o.face, o, l)
+        ## Whatever is not connected to existing geometry has nothing to be
+        ## consistent with, so let bmesh figure out its outside.
+        if todo:
+            bmesh.ops.recalc_face_normals(self.mesh, faces=list(todo))
+        neighbours = set(o.face for f in region for l in f.loops for o in l.link_loops)
+        for f in region | neighbours:
+            f.normal_update()
+
+    def sync(self, force=False, full_normals=False):
+        ## Only writes the mesh back if it was actually modified. Normals are
+        ## only fixed up around the modified region unless FULL_NORMALS.
+        with profiling.phase("sync"):
+            if self.bm is None or not (self.modified or force):
+                return
+            if full_normals:
+                bmesh.ops.recalc_face_normals(self.mesh, faces=self.mesh.faces)
+            self.commit(fix_normals=not full_normals)
+            self.modified = False
             if self.mesh.is_wrapped:
                 bmesh.update_edit_mesh(self.object.data)
+                ## The depsgraph reports this as the next geometry update.
+                epoch, geometry, _ = session_version(self.object)
+                self.synced = (epoch, geometry+1)
             else:
                 self.mesh.to_mesh(self.object.data)
                 self.object.data.update()
-            self.mesh.faces.ensure_lookup_table()
-            self.mesh.edges.ensure_lookup_table()
+                arrays = mesh_arrays(self.object.data)
+                self.fingerprint = mesh_fingerprint(self.object.data, arrays)
+                if not self.held:
+                    self.release_mesh(arrays)
+
+    def release_mesh(self, arrays):
+        ## Goes back to a view of the object mode mesh once our edits are
+        ## written back, rather than keeping a copy of it around. The indices
+        ## and the topology kernel are up to date with the edits, so the view
+        ## takes them over as they are.
+        self.bm.free()
+        self.bm = None
+        self.view = MeshView(*arrays)
+        for kind, index in self.indices.items():
+            if index.building is not None:
+                ## Its snapshot predates the edits we would have to replay.
+                index.reset()
+            elif index.tree is not None:
+                self.view.indices[kind] = index
+        self.dirty.clear()
+        self.pending.clear()
+        self.created.clear()
+        self.frames.clear()
+        self.version += 1
+
+    def commit(self, fix_normals=True):
+        ## Brings normals and indices up to date with the edits made since
+        ## the last commit, without writing the mesh back.
+        verts = [ v for v in self.dirty if v.is_valid ]
+        if fix_normals and verts:
+            self.fix_normals(set(f for v in verts for f in v.link_faces))
+        self.mesh.verts.index_update()
+        self.mesh.faces.index_update()
+        self.mesh.edges.index_update()
+        self.mesh.verts.ensure_lookup_table()
+        self.mesh.faces.ensure_lookup_table()
+        self.mesh.edges.ensure_lookup_table()
+        changed = {
+            'faces': set(f.index for v in verts for f in v.link_faces),
+            'edges': set(e.index for v in verts for e in v.link_edges),
+            'verts': set(v.index for v in verts),
+        }
+        changed['midpoints'] = changed['edges']
+        self.dirty.clear()
+        self.version += 1
+        for i in changed['faces']:
+            self.frames.pop(i, None)
+        for kind, index in self.indices.items():
+            if (index.tree is not None or index.building is not None) and changed[kind]:
+                index.update(self.mesh, changed[kind])
+        ## Keep the topology kernel, and the chains it found, for the next
+        ## rectangle rather than having refresh drop it over pending edits.
+        if self.topology is not None and self.pending:
+            self.commit_topology()
 
     def free(self, sync=False):
-        if self.mesh is not None:
+        if self.bm is not None:
             if sync:
                 self.sync()
-            self.mesh.free()
-        self.mesh = None
-        self.kd = None
+            self.bm.free()
+        self.bm = None
+        self.drop_view()
+        self.dirty.clear()
+        self.frames.clear()
+        self.modified = False
+
+    def valid(self):
+        try:
+            return (self.view is not None or self.bm is not None and self.bm.is_valid) and self.object.type == 'MESH'
+        except ReferenceError:
+            return False
 
     def from_mouse(self, context, mouse_pos):
         return self.to_local @ mouse_position_3d(context, mouse_pos)
@@ -125,23 +569,48 @@ class MeshTools():
         return self.closest_edge(self.from_mouse(context, mouse_pos))
 
     def closest_edge(self, point):
-        f = self.kd.find(point)[1]
-        if f is None:
-            return None
-        edges = self.mesh.faces[f].edges
-        if len(edges) < 1:
-            return None
-        e = edges[0]
-        d = edge_distance(e, point)
-        for i in range(1, len(edges)):
-            dt = edge_distance(edges[i], point)
-            if dt < d:
-                d = dt
-                e = edges[i]
-        p = edge_snap(e, point)
-        return (e,d,p,f)
+        res = self.closest_edges(point, 1)
+        return res[0] if res else None
+
+    def closest_edges(self, point, n):
+        ## Returns up to N (edge, distance, snapped point, face index) tuples
+        ## for the edges nearest to POINT, sorted by distance.
+        with profiling.phase("closest_edge"):
+            res = []
+            if self.bm is None:
+                ## Edges of the view have no faces to tell about.
+                for i,d in self.view.index('edges').find_n(point, n):
+                    e = ViewEdge(self.view, i)
+                    res.append((e, d, edge_snap(e, point), None))
+                return res
+            for i,d in self.ensure_index('edges').find_n(point, n, self.mesh):
+                e = self.mesh.edges[i]
+                f = e.link_faces[0].index if e.link_faces else None
+                res.append((e, d, edge_snap(e, point), f))
+            return res
+
+    def snap_target(self, point, radius):
+        ## Returns the vertex or edge midpoint closest to POINT if it is
+        ## within RADIUS, otherwise None.
+        with profiling.phase("snap_target"):
+            best = None
+            for kind in ('verts', 'midpoints'):
+                if self.bm is None:
+                    found = [ (self.view.entry(kind, i), d) for i,d in self.view.index(kind).find_n(point, 1) ]
+                else:
+                    index = self.ensure_index(kind)
+                    found = [ (index.entry(index.elements(self.bm)[i]), d) for i,d in index.find_n(point, 1, self.bm) ]
+                for p,d in found:
+                    if d <= radius and (best is None or d < best[1]):
+                        best = (p, d)
+            return None if best is None else best[0]
 
     def closest_connected_edge(self, e, point):
+        topology = self.ensure_topology()
+        if topology is not None:
+            res = self.topology_edge(topology.closest_connected_edge(e.index, point))
+            if res is not None:
+                return res
         f = edge_factor(e, point)
         dir = edge_dir(e).normalized()
         if f < 0:
@@ -166,42 +635,116 @@ class MeshTools():
             f = edge_factor(e, point)
         return e
 
-    def edge_path(self, start, end):
-        ## KLUDGE: this is really terrible, but we're essentially doing a dijkstra
-        visited = set()
+    def edge_path(self, start, end, restrict=False):
+        ## A* search from START to END, weighted by edge length. If RESTRICT
+        ## is true the search first only considers edges that are collinear
+        ## with the segment and within its bounding box, which is the common
+        ## case for subdivided straight edges, before falling back.
+        if start == end:
+            return []
+        topology = self.ensure_topology()
+        if topology is not None:
+            path = None
+            if restrict:
+                path = topology.edge_path(start.index, end.index, restrict=True)
+            if path is None:
+                path = topology.edge_path(start.index, end.index)
+            edges = []
+            for i in (path or []):
+                edges.append(self.topology_edge(i))
+                if self.topology is None:
+                    break
+            else:
+                return edges
+        if restrict:
+            dir = (end.co-start.co).normalized()
+            lo = Vector([min(a,b) for a,b in zip(start.co, end.co)])
+            hi = Vector([max(a,b) for a,b in zip(start.co, end.co)])
+            eps = 1e-4 * max(1.0, (end.co-start.co).length)
+            def admissible(v, e):
+                if abs(edge_dir(e).normalized().dot(dir)) < 0.999:
+                    return False
+                return all(l-eps <= c <= h+eps for l,c,h in zip(lo, v.co, hi))
+            path = self.astar(start, end, admissible)
+            if path is not None:
+                return path
+        path = self.astar(start, end)
+        return [] if path is None else path
+
+    def astar(self, start, end, admissible=None):
+        goal = end.co
         prev = {}
-        queue = []
-        dist = defaultdict(lambda: math.inf)
-        dist[start] = 0.0
-        class Vert:
-            def __init__(self, v, dist=0.0):
-                self.v = v
-                self.dist = dist
-            def __lt__(self, other):
-                return self.dist < other.dist
-
-        heapq.heappush(queue, Vert(start))
+        dist = {start: 0.0}
+        visited = set()
+        ## The counter breaks ties so that verts never need to be compared.
+        n = 0
+        queue = [((goal-start.co).length, n, start)]
         while queue:
-            u = heapq.heappop(queue)
-            u = u.v
+            _, _, u = heapq.heappop(queue)
+            if u == end:
+                edges = []
+                while u != start:
+                    u,e = prev[u]
+                    edges.append(e)
+                return edges
+            if u in visited:
+                continue
             visited.add(u)
+            du = dist[u]
             for e in u.link_edges:
                 v = e.other_vert(u)
                 if v in visited:
                     continue
-                alt = dist[u] + (v.co-start.co).length
-                if dist[v] > alt:
+                if admissible is not None and not admissible(v, e):
+                    continue
+                alt = du + e.calc_length()
+                if alt < dist.get(v, math.inf):
                     prev[v] = (u,e)
                     dist[v] = alt
-                    heapq.heappush(queue, Vert(v, alt))
-        edges = []
-        u = end
-        while u is not None:
-            u = prev.get(u)
-            if u is not None:
-                (u,e) = u
-                edges.append(e)
-        return edges
+                    n += 1
+                    heapq.heappush(queue, (alt + (goal-v.co).length, n, v))
+        return None
+
+    def rect_path(self, i, start, end):
+        ## Read-only counterpart of the path search in create_rect, returning
+        ## the coordinates of the path's vertices strictly between START and
+        ## END along edge I, for previews.
+        if self.counts()[1] <= i:
+            return []
+        if self.bm is None:
+            return self.view_rect_path(i, start, end)
+        if not self.bm.is_valid:
+            return []
+        se = self.bm.edges[i]
+        ee = self.closest_connected_edge(se, end)
+        a = min(se.verts, key=lambda v: (v.co-start).length)
+        b = min(ee.verts, key=lambda v: (v.co-end).length)
+        verts = set([a,b])
+        for e in self.edge_path(a, b, restrict=True):
+            verts.update(e.verts)
+        points = [ (line_factor(v.co, start, end), v.co.copy()) for v in verts ]
+        points = [ x for x in points if 0.0 < x[0] < 1.0 ]
+        points.sort(key=lambda x: x[0])
+        return [ co for f,co in points ]
+
+    def view_rect_path(self, i, start, end):
+        ## Same as rect_path, but walks the topology kernel, which can be
+        ## built from the view, so that previews don't need the bmesh either.
+        topology = self.ensure_topology()
+        co = topology.co
+        ee = topology.closest_connected_edge(i, end)
+        a = min(topology.edge_verts(i), key=lambda v: (Vector(co[v])-start).length)
+        b = min(topology.edge_verts(ee), key=lambda v: (Vector(co[v])-end).length)
+        path = topology.edge_path(a, b, restrict=True)
+        if path is None:
+            path = topology.edge_path(a, b) or []
+        verts = set([a,b])
+        for e in path:
+            verts.update(topology.edge_verts(e))
+        points = [ (line_factor(Vector(co[v]), start, end), Vector(co[v])) for v in verts ]
+        points = [ x for x in points if 0.0 < x[0] < 1.0 ]
+        points.sort(key=lambda x: x[0])
+        return [ co for f,co in points ]
 
     def select(self, thing):
         for face in self.mesh.faces:
@@ -216,11 +759,14 @@ class MeshTools():
         else:
             thing.select = True
         self.mesh.select_flush(True)
+        self.modified = True
 
     def create_vertex(self, e, point):
         f = edge_factor(e, point)
         if (0 < f and f < 1):
-            return bmesh.utils.edge_split(e, e.verts[0], f)[1]
+            v = bmesh.utils.edge_split(e, e.verts[0], f)[1]
+            self.mark_dirty([v], created=True)
+            return v
         elif 0 == f:
             return e.verts[0]
         elif 1 == f:
@@ -230,34 +776,216 @@ class MeshTools():
             v = e.verts[0] if f < 0 else e.verts[1]
             v = bmesh.ops.extrude_vert_indiv(self.mesh, verts=[v])['verts'][0]
             v.co = point
+            self.mark_dirty([v], created=True)
             return v
 
     def create_rect(self, se, start, point, dissolve_verts=True):
         ## If we have no edge, create it from a base direction
-        if se is None:
-            c2 = edge_snap(FakeEdge(start), point)
-            a = self.mesh.verts.new(start)
-            b = self.mesh.verts.new(c2)
-            se = self.mesh.edges.new([a,b])
-        ## First handle the endpoints, create vertices as necessary
-        start = self.create_vertex(se, start)
-        ee = self.closest_connected_edge(se, point)
-        end = self.create_vertex(ee, edge_snap(ee, point))
-        if end == start:
-            return None
-        disp = point-end.co
-        ## Now that we have the bounding vertices, perform the edge extrusion
-        es = self.edge_path(start, end)
-        data = bmesh.ops.extrude_edge_only(self.mesh, edges=es)['geom']
-        verts = [ x for x in data if isinstance(x, bmesh.types.BMVert) ]
-        verts.sort(key=lambda v : edge_factor(se, v.co))
-        for v in verts:
-            v.co = v.co+disp
-        if 2 < len(verts) and dissolve_verts:
-            ## Fuse away the inner vertices in the new edge that were created
-            bmesh.ops.dissolve_verts(self.mesh, verts=verts[1:-1])
-            verts = (verts[0], verts[-1])
-            es = edge_between(verts[0],verts[1])
-        else:
-            es = self.edge_path(verts[0],verts[-1])
-        return (verts,es)
+        with profiling.phase("create_rect"):
+            if se is None:
+                c2 = edge_snap(FakeEdge(start), point)
+                a = self.mesh.verts.new(start)
+                b = self.mesh.verts.new(c2)
+                se = self.mesh.edges.new([a,b])
+                self.mark_dirty([a,b], created=True)
+            ## First handle the endpoints, create vertices as necessary
+            start = self.create_vertex(se, start)
+            ee = self.closest_connected_edge(se, point)
+            end = self.create_vertex(ee, edge_snap(ee, point))
+            if end == start:
+                return None
+            disp = point-end.co
+            es = self.edge_path(start, end, restrict=True)
+            if not es:
+                return None
+            if dissolve_verts:
+                return self.create_quad(start, end, es, disp)
+            ## Now that we have the bounding vertices, perform the edge extrusion
+            data = bmesh.ops.extrude_edge_only(self.mesh, edges=es)['geom']
+            verts = [ x for x in data if isinstance(x, bmesh.types.BMVert) ]
+            self.mark_dirty(verts, created=True)
+            verts.sort(key=lambda v : edge_factor(se, v.co))
+            for v in verts:
+                v.co = v.co+disp
+            es = self.edge_path(verts[0], verts[-1], restrict=True)
+            self.mark_dirty([start, end, *verts])
+            return (verts,es)
+
+    def create_quad(self, start, end, es, disp):
+        ## Builds the face spanned by the path ES and its copy displaced by
+        ## DISP directly, which is what extruding the path and dissolving the
+        ## inner verts of the new edge would result in, but without creating
+        ## and destroying geometry for every edge on the path.
+        path = [start]
+        for e in reversed(es):
+            path.append(e.other_vert(path[-1]))
+        a = self.mesh.verts.new(start.co+disp)
+        b = self.mesh.verts.new(end.co+disp)
+        ## Like the extrusion, take the face attributes from a neighbour
+        example = next((f for e in es for f in e.link_faces), None)
+        self.mesh.faces.new([*path, b, a], example)
+        self.mark_dirty([a, b], created=True)
+        self.mark_dirty([start, end])
+        return ((a, b), edge_between(a, b))
+
+## Shared MeshTools per object, so that the gizmo, the operator and any
+## other users borrow the same bmesh and indices. Sessions are only refreshed
+## when the depsgraph tells us that something about the object changed, and
+## the least recently used ones are dropped past MAX_SESSIONS.
+sessions = {}
+max_sessions = 32
+## Keys of sessions in use by a sweep over many objects, which must not be
+## evicted before it is done.
+pinned = set()
+geometry_versions = defaultdict(int)
+transform_versions = defaultdict(int)
+epoch = 0
+## Bumped on any update at all, for caches over the whole scene.
+scene_updates = 0
+
+def note_updates(depsgraph):
+    global scene_updates
+    scene_updates += 1
+    ## A mesh is usually reported both through its object and by itself, but
+    ## is only bumped once per evaluation, so that MeshTools.sync can tell
+    ## which version its own update results in.
+    geometry = set()
+    for update in depsgraph.updates:
+        id = update.id.original
+        if isinstance(id, bpy.types.Object):
+            if update.is_updated_transform:
+                transform_versions[id.as_pointer()] += 1
+            if update.is_updated_geometry and id.type == 'MESH':
+                geometry.add(id.data.as_pointer())
+        elif isinstance(id, bpy.types.Mesh) and update.is_updated_geometry:
+            geometry.add(id.as_pointer())
+    for key in geometry:
+        geometry_versions[key] += 1
+
+def note_undo():
+    ## Undo swaps out data wholesale, so consider everything changed.
+    global epoch, scene_updates
+    epoch += 1
+    scene_updates += 1
+
+def scene_version():
+    return scene_updates
+
+def session_version(object):
+    return (epoch, geometry_versions[object.data.as_pointer()], transform_versions[object.as_pointer()])
+
+def session(object):
+    key = object.as_pointer()
+    mt = sessions.pop(key, None)
+    if mt is not None and mt.valid() and mt.object.data == object.data and mt.is_wrapped() == object.data.is_editmode:
+        version = session_version(object)
+        if mt.held:
+            pass
+        elif version[:2] != mt.seen[:2]:
+            mt.refresh()
+        elif version != mt.seen:
+            mt.update_transform()
+        if not mt.held:
+            mt.seen = version
+        sessions[key] = mt
+        return mt
+    if mt is not None:
+        mt.free()
+    mt = MeshTools(object)
+    mt.seen = session_version(object)
+    sessions[key] = mt
+    while max_sessions < len(sessions):
+        key = next((key for key in sessions if key not in pinned), None)
+        if key is None:
+            break
+        release_session(key)
+    return mt
+
+def release_session(key):
+    mt = sessions.pop(key)
+    try:
+        mt.free(sync=mt.valid())
+    except ReferenceError:
+        pass
+
+def release_sessions(object=None):
+    for key, mt in list(sessions.items()):
+        if object is None or mt.object == object:
+            release_session(key)
+
+def index_stats():
+    ## The counters of the spatial indices of all sessions, summed by kind.
+    totals = {}
+    for mt in sessions.values():
+        for kind, stats in mt.index_stats().items():
+            total = totals.setdefault(kind, dict.fromkeys(("size", "overlay", "hits", "misses", "rebuilds", "updates"), 0))
+            for key in total:
+                total[key] += stats[key]
+    return totals
+
+profiling.sources["indices"] = index_stats
+
+## Picking across objects. Every object keeps its own session and edge
+## index in local space, so instead of merging them into one structure, the
+## objects are visited by the distance of the query point to their world
+## space bounds, and only as long as they could still hold a closer edge.
+bounds_cache = {}
+
+def world_bounds(object):
+    version = session_version(object)
+    cached = bounds_cache.get(object.as_pointer())
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    corners = [ object.matrix_world @ Vector(c) for c in object.bound_box ]
+    bounds = (Vector([min(c[i] for c in corners) for i in range(3)]),
+              Vector([max(c[i] for c in corners) for i in range(3)]))
+    bounds_cache[object.as_pointer()] = (version, bounds)
+    return bounds
+
+pick_limit = 16
+
+def bounds_distance(bounds, point):
+    lo, hi = bounds
+    return Vector([max(l-p, 0.0, p-h) for l,p,h in zip(lo, point, hi)]).length
+
+def pick_objects(context):
+    ## The objects the rectangle tool can extend in the current mode.
+    if context.mode == 'EDIT_MESH':
+        objects = context.objects_in_mode
+    else:
+        objects = context.visible_objects
+    ## Linked objects and meshes can't be written to.
+    return [ o for o in objects if o.type == 'MESH' and o.visible_get()
+             and o.library is None and o.data.library is None ]
+
+def pick_edge(objects, point):
+    ## Returns (session, (edge, distance, snapped point, face index)) for the
+    ## edge closest to the world space POINT across OBJECTS, with the point
+    ## in the object's local space and the distance in world space, or None.
+    ## Also returns whether some index is still being built. Only the
+    ## PICK_LIMIT objects nearest to the point are considered, so that a
+    ## sweep over a large scene neither builds indices for all of it nor
+    ## evicts the sessions it just created.
+    with profiling.phase("pick_edge"):
+        best = None
+        building = False
+        nearest = sorted(((bounds_distance(world_bounds(o), point), o) for o in objects), key=lambda x: x[0])
+        try:
+            for d, object in nearest[:pick_limit]:
+                if best is not None and best[1][1] < d:
+                    break
+                mt = session(object)
+                pinned.add(object.as_pointer())
+                if not mt.index_ready('edges'):
+                    building = True
+                    continue
+                res = mt.closest_edge(mt.to_local @ point)
+                if res is None:
+                    continue
+                e,_,p,f = res
+                d = (mt.from_local @ edge_snap(e, mt.to_local @ point, True) - point).length
+                if best is None or d < best[1][1]:
+                    best = (mt, (e, d, p, f))
+        finally:
+            pinned.clear()
+        return best, building
@@ -0,0 +1,234 @@
+import bpy
+import cProfile
+import json
+import pstats
+import time
+from collections import deque
+
+## Low overhead timers for the tool's hot paths. While disabled, phase()
+## hands out a shared no-op context manager, so the only cost is the call.
+enabled = False
+phases = {}
+counters = {}
+profile_remaining = 0
+profile_path = None
+profiler = None
+## Whether timings are collected once the capture in progress is done.
+profile_restore = False
+## Functions returning further stats to include by name, for state that is
+## kept elsewhere, like the counters of the spatial indices.
+sources = {}
+
+class Phase():
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=2048)
+        self.start = None
+        self.profile = False
+
+    def __enter__(self):
+        if self.profile:
+            start_profile()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.add(time.perf_counter() - self.start)
+        if self.profile:
+            stop_profile()
+        return False
+
+    def add(self, t):
+        self.calls += 1
+        self.total += t
+        self.max = max(self.max, t)
+        self.samples.append(t)
+
+    def percentile(self, p):
+        if not self.samples:
+            return 0.0
+        samples = sorted(self.samples)
+        return samples[min(len(samples)-1, int(p * len(samples)))]
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "total": self.total,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "max": self.max,
+        }
+
+class NullPhase():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+null_phase = NullPhase()
+
+def phase(name, profile=False):
+    ## If PROFILE is true and a capture is armed, the phase is also run
+    ## under cProfile.
+    if not enabled:
+        return null_phase
+    p = phases.get(name)
+    if p is None:
+        p = phases[name] = Phase(name)
+    p.profile = profile and 0 < profile_remaining
+    return p
+
+def record(name, seconds):
+    ## For timings taken elsewhere, like on a worker thread.
+    if enabled:
+        p = phases.get(name)
+        if p is None:
+            p = phases[name] = Phase(name)
+        p.add(seconds)
+
+def count(name, n=1):
+    if enabled:
+        counters[name] = counters.get(name, 0) + n
+
+def reset():
+    phases.clear()
+    counters.clear()
+
+def stats():
+    return {
+        "phases": { name: p.stats() for name, p in phases.items() },
+        "counters": dict(counters),
+        **{ name: source() for name, source in sources.items() },
+    }
+
+def set_enabled(value):
+    ## A capture needs the timers, so while one is in progress the setting
+    ## only takes effect once it is done.
+    global enabled, profile_restore
+    if profiler is None:
+        enabled = value
+    else:
+        profile_restore = value
+
+def capture_profile(n, path):
+    global profile_remaining, profile_path, profiler, enabled, profile_restore
+    if profiler is None:
+        profile_restore = enabled
+    enabled = True
+    profile_remaining = n
+    profile_path = path
+    profiler = cProfile.Profile()
+
+def start_profile():
+    if profiler is not None:
+        profiler.enable()
+
+def stop_profile():
+    global profile_remaining, profiler, enabled
+    if profiler is None:
+        return
+    profiler.disable()
+    profile_remaining -= 1
+    if profile_remaining <= 0:
+        profiler.dump_stats(profile_path)
+        with open(profile_path + ".txt", "w") as f:
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(50)
+        profiler = None
+        enabled = profile_restore
+
+class SHIRAKUMO_RECT_OT_dump_stats(bpy.types.Operator):
+    bl_idname = "mesh.rectangle_dump_stats"
+    bl_label = "Dump Rectangle Tool Stats"
+    bl_description = "Write the rectangle tool's timers and counters to a JSON file"
+
+    filepath: bpy.props.StringProperty(
+        name="File",
+        subtype="FILE_PATH",
+        default="//rectangle_stats.json")
+
+    def execute(self, context):
+        path = bpy.path.abspath(self.filepath)
+        with open(path, "w") as f:
+            json.dump(stats(), f, indent=2)
+        self.report({'INFO'}, f"Wrote {path}")
+        return {'FINISHED'}
+
+class SHIRAKUMO_RECT_OT_reset_stats(bpy.types.Operator):
+    bl_idname = "mesh.rectangle_reset_stats"
+    bl_label = "Reset Rectangle Tool Stats"
+    bl_description = "Clear the rectangle tool's timers and counters"
+
+    def execute(self, context):
+        reset()
+        return {'FINISHED'}
+
+class SHIRAKUMO_RECT_OT_capture_profile(bpy.types.Operator):
+    bl_idname = "mesh.rectangle_capture_profile"
+    bl_label = "Profile Next Rectangles"
+    bl_description = "Capture a cProfile of the next rectangle commits"
+
+    count: bpy.props.IntProperty(
+        name="Count",
+        default=10, min=1,
+        description="Number of rectangle commits to profile")
+    filepath: bpy.props.StringProperty(
+        name="File",
+        subtype="FILE_PATH",
+        default="//rectangle.prof")
+
+    def execute(self, context):
+        capture_profile(self.count, bpy.path.abspath(self.filepath))
+        self.report({'INFO'}, f"Profiling the next {self.count} rectangles")
+        return {'FINISHED'}
+
+class SHIRAKUMO_RECT_PT_stats(bpy.types.Panel):
+    bl_idname = "SHIRAKUMO_RECT_PT_stats"
+    bl_label = "Rectangle Tool Stats"
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = "Rectangle"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        layout.prop(context.preferences.addons[__package__].preferences, "profiling")
+        if phases:
+            grid = layout.grid_flow(columns=5, even_columns=False, align=True)
+            for label in ("Phase", "Calls", "p50 ms", "p95 ms", "Max ms"):
+                grid.label(text=label)
+            for name, p in sorted(phases.items()):
+                grid.label(text=name)
+                grid.label(text=str(p.calls))
+                grid.label(text="%.2f" % (p.percentile(0.5)*1000))
+                grid.label(text="%.2f" % (p.percentile(0.95)*1000))
+                grid.label(text="%.2f" % (p.max*1000))
+        for name, n in sorted(counters.items()):
+            layout.label(text=f"{name}: {n}")
+        for name, source in sorted(sources.items()):
+            for key, values in sorted(source().items()):
+                layout.label(text=f"{name} {key}: " + ", ".join(f"{k} {v}" for k,v in values.items()))
+        if profiler is not None:
+            layout.label(text=f"Profiling {profile_remaining} more", icon='REC')
+        row = layout.row(align=True)
+        row.operator(SHIRAKUMO_RECT_OT_dump_stats.bl_idname, text="Dump")
+        row.operator(SHIRAKUMO_RECT_OT_reset_stats.bl_idname, text="Reset")
+        row.operator(SHIRAKUMO_RECT_OT_capture_profile.bl_idname, text="Profile")
+
+registered_classes = [
+    SHIRAKUMO_RECT_OT_dump_stats,
+    SHIRAKUMO_RECT_OT_reset_stats,
+    SHIRAKUMO_RECT_OT_capture_profile,
+    SHIRAKUMO_RECT_PT_stats,
+]
+
+def register():
+    for cls in registered_classes:
+        bpy.utils.register_class(cls)
+
+def unregister():
+    for cls in registered_classes:
+        bpy.utils.unregister_class(cls)
@@ -1,46 +1,113 @@
 import gpu
-from mathutils import Matrix
+from mathutils import Matrix, Vector
 from gpu_extras.batch import batch_for_shader
-from struct import pack
-
-vert_out = gpu.types.GPUStageInterfaceInfo("my_interface")
-vert_out.smooth('VEC3', "pos")
-
-shader_info = gpu.types.GPUShaderCreateInfo()
-shader_info.push_constant('MAT4', "u_ViewProjectionMatrix")
-shader_info.push_constant('VEC3', "u_v", 4)
-shader_info.push_constant('VEC4', "u_Color")
-shader_info.vertex_in(0, 'INT', "n")
-shader_info.vertex_out(vert_out)
-shader_info.fragment_out(0, 'VEC4', "FragColor")
-
-shader_info.vertex_source(
-    "void main()"
-    "{"
-    "  gl_Position = u_ViewProjectionMatrix * vec4("
-    "    u_v[n],"
-    "    1.0f);"
-    "}"
-)
-
-shader_info.fragment_source(
-    "void main()"
-    "{"
-    "  FragColor = u_Color;"
-    "}"
-)
-
-shader = gpu.shader.create_from_info(shader_info)
-del vert_out
-del shader_info
-
-batch = batch_for_shader(shader, 'TRIS', {
-    "n": [0,1,2,0,2,3]
-})
-
-def rect(context, points, matrix=Matrix.Identity(4)):
-    shader.bind()
-    shader.uniform_float("u_ViewProjectionMatrix", context.region_data.perspective_matrix @ matrix)
-    shader.uniform_vector_float(shader.uniform_from_name("u_v"), pack("12f",*points), 3, 4)
-    shader.uniform_float("u_Color", (0.5,0.5,0.9,0.5))
-    batch.draw(shader)
+
+## The shader is only compiled on the first draw, so that importing the addon
+## stays cheap and works without a GPU, as under blender --background.
+shader = None
+
+def ensure_shader():
+    global shader
+    if shader is not None:
+        return shader
+    vert_out = gpu.types.GPUStageInterfaceInfo("SHIRAKUMO_RECT_interface")
+    vert_out.smooth('VEC4', "v_Color")
+
+    shader_info = gpu.types.GPUShaderCreateInfo()
+    shader_info.push_constant('MAT4', "u_ViewProjectionMatrix")
+    shader_info.vertex_in(0, 'VEC3', "pos")
+    shader_info.vertex_in(1, 'VEC4', "color")
+    shader_info.vertex_out(vert_out)
+    shader_info.fragment_out(0, 'VEC4', "FragColor")
+
+    shader_info.vertex_source(
+        "void main()"
+        "{"
+        "  v_Color = color;"
+        "  gl_Position = u_ViewProjectionMatrix * vec4(pos, 1.0f);"
+        "}"
+    )
+
+    shader_info.fragment_source(
+        "void main()"
+        "{"
+        "  FragColor = v_Color;"
+        "}"
+    )
+
+    shader = gpu.shader.create_from_info(shader_info)
+    return shader
+
+fill_color = (0.5,0.5,0.9,0.5)
+committed_color = (0.5,0.9,0.5,0.4)
+path_color = (0.9,0.6,0.2,0.9)
+edge_color = (1.0,1.0,1.0,0.9)
+marker_color = (1.0,1.0,0.3,1.0)
+
+class Tris():
+    ## Accumulates everything the preview draws as triangles, so that the
+    ## whole preview can be drawn with a single batch.
+    def __init__(self, normal, width):
+        self.pos = []
+        self.color = []
+        self.normal = normal
+        self.width = width
+
+    def quad(self, a, b, c, d, color):
+        self.pos.extend((a,b,c, a,c,d))
+        self.color.extend((color,)*6)
+
+    def segment(self, a, b, color):
+        side = self.normal.cross(b-a)
+        if side.length_squared == 0.0:
+            side = (b-a).orthogonal()
+        if side.length_squared == 0.0:
+            return
+        side = side.normalized() * (self.width/2)
+        self.quad(a-side, b-side, b+side, a+side, color)
+
+    def marker(self, p, color):
+        u = self.normal.orthogonal().normalized() * self.width
+        v = self.normal.cross(u)
+        self.quad(p-u-v, p+u-v, p+u+v, p-u+v, color)
+
+class Preview():
+    ## Keeps the batch around until the previewed geometry changes.
+    def __init__(self):
+        self.key = None
+        self.batch = None
+        ## Rectangles that were already committed but not yet written back
+        ## to the mesh, drawn as plain fills.
+        self.committed = []
+
+    def update(self, key, c1=None, c2=None, c3=None, c4=None, path=(), ghosts=()):
+        if key == self.key and self.batch is not None:
+            return
+        self.key = key
+        tris = Tris(Vector([0,0,1]), 0.0)
+        for quad in self.committed:
+            tris.quad(*quad, committed_color)
+        if c1 is None:
+            self.batch = batch_for_shader(ensure_shader(), 'TRIS', {"pos": tris.pos, "color": tris.color})
+            return
+        normal = (c2-c1).cross(c3-c2)
+        tris.normal = normal.normalized() if normal.length_squared != 0.0 else Vector([0,0,1])
+        tris.width = 0.01 * max((c3-c1).length, 0.1)
+        tris.quad(c1, c2, c3, c4, fill_color)
+        points = [c1, *path, c2]
+        for a,b in zip(points, points[1:]):
+            tris.segment(a, b, path_color)
+        tris.segment(c3, c4, edge_color)
+        for p in (c1, c2, c3, c4, *ghosts):
+            tris.marker(p, marker_color)
+        self.batch = batch_for_shader(ensure_shader(), 'TRIS', {"pos": tris.pos, "color": tris.color})
+
+    def draw(self, context, matrix=Matrix.Identity(4)):
+        if self.batch is None:
+            return
+        shader = ensure_shader()
+        shader.bind()
+        shader.uniform_float("u_ViewProjectionMatrix", context.region_data.perspective_matrix @ matrix)
+        gpu.state.blend_set('ALPHA')
+        self.batch.draw(shader)
+        gpu.state.blend_set('NONE')
@@ -0,0 +1,116 @@
+import bpy
+import os
+import time
+import numpy as np
+from mathutils import Vector
+from .mesh import session
+from .tiles import greedy_rects, rect_outlines
+
+## Turns 2D occupancy grids into geometry. Tiles are a boolean array indexed
+## as [row, column] with row 0 at the bottom, and every filled cell becomes
+## a GRID sized square in the object's local XY plane. Cells are merged into
+## rectangles before anything touches the mesh, see tiles.
+
+def load_tiles(filepath, threshold=0.5):
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == '.npy':
+        ## Arrays and CSV files are written top row first, like they read.
+        values = np.load(filepath)[::-1]
+    elif ext in ('.csv', '.txt'):
+        values = np.loadtxt(filepath, delimiter=',', ndmin=2)[::-1]
+    else:
+        image = bpy.data.images.load(filepath, check_existing=False)
+        try:
+            w,h = image.size
+            channels = image.channels
+            pixels = np.empty(w*h*channels, dtype=np.float32)
+            image.pixels.foreach_get(pixels)
+            pixels = pixels.reshape(h, w, channels)
+        finally:
+            bpy.data.images.remove(image)
+        ## Opaque bright pixels are filled.
+        values = pixels[:,:,:3].mean(axis=2) if 3 <= channels else pixels[:,:,0]
+        if channels == 4:
+            values = values * pixels[:,:,3]
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim != 2:
+        raise ValueError(f"Expected a 2D tile map, got shape {values.shape}")
+    return threshold < values
+
+def tiles_to_mesh(object, tiles, grid=0.1, offset=Vector()):
+    ## Adds the rectangles covering TILES to OBJECT's mesh in one go and
+    ## returns a report of the conversion.
+    begin = time.perf_counter()
+    rects = greedy_rects(tiles)
+    points, outlines = rect_outlines(rects)
+    mt = session(object)
+    mesh = mt.mesh
+    verts = [ mesh.verts.new((x*grid + offset.x, y*grid + offset.y, offset.z)) for x,y in points.tolist() ]
+    for outline in outlines:
+        mesh.faces.new([ verts[i] for i in outline ])
+    mt.mark_dirty(verts, created=True)
+    ## The faces are wound counter-clockwise, so their normals already
+    ## point up and don't need fixing.
+    mt.commit(fix_normals=False)
+    mt.sync()
+    total = time.perf_counter() - begin
+    return {
+        "object": object.name,
+        "cells": int(np.count_nonzero(tiles)),
+        "rects": len(rects),
+        "verts": len(verts),
+        "seconds": total,
+    }
+
+class SHIRAKUMO_RECT_OT_tiles_to_rectangles(bpy.types.Operator):
+    bl_idname = "mesh.tiles_to_rectangles"
+    bl_label = "Tiles to rectangles"
+    bl_options = {'REGISTER', 'UNDO'}
+    bl_description = "Build geometry from a tile map image, .npy or CSV file, merging cells into rectangles"
+
+    filepath: bpy.props.StringProperty(
+        name="File",
+        subtype="FILE_PATH",
+        description="Image, NumPy .npy or CSV file with the tile map")
+    grid: bpy.props.FloatProperty(
+        name="Grid",
+        default=0.1, min=0.0, options=set(),
+        description="The size of a single tile")
+    threshold: bpy.props.FloatProperty(
+        name="Threshold",
+        default=0.5, options=set(),
+        description="Values above this are considered filled tiles")
+
+    @classmethod
+    def poll(cls, context):
+        return (context.object is not None and context.object.type == 'MESH')
+
+    def execute(self, context):
+        try:
+            tiles = load_tiles(bpy.path.abspath(self.filepath), self.threshold)
+        except (OSError, RuntimeError, ValueError) as e:
+            self.report({'ERROR'}, f"Failed to read tile map: {e}")
+            return {'CANCELLED'}
+        report = tiles_to_mesh(context.object, tiles, self.grid)
+        self.report({'INFO'}, "Merged %i tiles into %i rectangles in %.3fs" % (
+            report["cells"], report["rects"], report["seconds"]))
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        self.grid = context.preferences.addons[__package__].preferences.grid
+        if self.filepath:
+            return self.execute(context)
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+registered_classes = [
+    SHIRAKUMO_RECT_OT_tiles_to_rectangles,
+]
+
+def register():
+    for cls in registered_classes:
+        bpy.utils.register_class(cls)
+
+def unregister():
+    for cls in registered_classes:
+        bpy.utils.unregister_class(cls)
@@ -0,0 +1,64 @@
+import numpy as np
+from bisect import bisect_left, bisect_right
+
+## The geometry of tile maps, without touching any mesh. Like topology this
+## only depends on NumPy. Tiles are a boolean array indexed as [row, column]
+## with row 0 at the bottom.
+
+def greedy_rects(tiles):
+    ## Returns (x, y, w, h) cell rectangles that exactly cover TILES. Going
+    ## through the cells row by row, every cell that is not covered yet
+    ## starts a rectangle, which is first made as wide and then as tall as
+    ## possible. This is not guaranteed to give the fewest rectangles, which
+    ## would need a much more involved partitioning, but is close on maps.
+    free = np.array(tiles, dtype=bool)
+    h,w = free.shape
+    rects = []
+    for y in range(h):
+        row = free[y]
+        x = 0
+        while True:
+            starts = np.flatnonzero(row[x:])
+            if len(starts) == 0:
+                break
+            x += int(starts[0])
+            ends = np.flatnonzero(~row[x:])
+            x1 = x + int(ends[0]) if len(ends) else w
+            y1 = y + 1
+            while y1 < h and free[y1, x:x1].all():
+                y1 += 1
+            free[y:y1, x:x1] = False
+            rects.append((x, y, x1-x, y1-y))
+            x = x1
+    return rects
+
+def rect_outlines(rects):
+    ## Returns the corner points of all RECTS and, per rectangle, the
+    ## counter-clockwise list of point indices on its outline. Outlines
+    ## include the corners of neighbours that lie on an edge, so adjacent
+    ## rectangles share their verts and the result has no T-junctions.
+    rects = np.asarray(rects, dtype=np.int64).reshape(-1,4)
+    x0,y0 = rects[:,0], rects[:,1]
+    x1,y1 = x0+rects[:,2], y0+rects[:,3]
+    corners = np.stack([np.stack([x0,y0],1), np.stack([x1,y0],1), np.stack([x1,y1],1), np.stack([x0,y1],1)], 1).reshape(-1,2)
+    w = int(x1.max()) + 1 if len(rects) else 1
+    keys = np.unique(corners[:,1]*w + corners[:,0])
+    points = np.stack([keys % w, keys // w], 1)
+    rows = {}
+    cols = {}
+    for i,(x,y) in enumerate(points.tolist()):
+        rows.setdefault(y, []).append((x,i))
+        cols.setdefault(x, []).append((y,i))
+    ## The points are sorted by y then x, so the lists are already in order.
+    rows = { y: ([ x for x,i in l ], [ i for x,i in l ]) for y,l in rows.items() }
+    cols = { x: ([ y for y,i in l ], [ i for y,i in l ]) for x,l in cols.items() }
+    def span(lines, at, lo, hi):
+        keys,ids = lines[at]
+        return ids[bisect_left(keys, lo):bisect_right(keys, hi)]
+    outlines = []
+    for a,b,c,d in zip(x0.tolist(), y0.tolist(), x1.tolist(), y1.tolist()):
+        outlines.append(span(rows, b, a, c)[:-1]
+                        + span(cols, c, b, d)[:-1]
+                        + span(rows, d, a, c)[:0:-1]
+                        + span(cols, a, b, d)[:0:-1])
+    return points, outlines
@@ -1,8 +1,11 @@
 import bpy
 import bmesh
+import json
 from bl_ui.space_toolsystem_toolbar import VIEW3D_PT_tools_active as tools
 from mathutils import Vector, Matrix
 from . import render
+from . import profiling
+from . import arrays
 from .mesh import *
 
 def preferences():
@@ -54,6 +57,26 @@ class SHIRAKUMO_RECT_OT_draw_rectangle(bpy.types.Operator):
         name="Dissolve Verts",
         default=True, options=set(),
         description="Whether to dissolve superfluous vertices on the extruded edge")
+    chain: bpy.props.BoolProperty(
+        name="Chain",
+        default=False, options=set(['SKIP_SAVE']),
+        description="Keep drawing rectangles until confirmed, as a single undo step")
+    snap_radius: bpy.props.IntProperty(
+        name="Snap Radius",
+        default=12, min=0, subtype='PIXEL', options=set(),
+        description="Distance in pixels within which the end point snaps to vertices and edge midpoints, 0 to disable")
+    target: bpy.props.StringProperty(
+        name="Object",
+        description="The object to extend, the active one if empty",
+        options=set(['HIDDEN','SKIP_SAVE','SKIP_PRESET']))
+    snapped: bpy.props.BoolProperty(
+        name="Snapped",
+        default=False,
+        options=set(['HIDDEN','SKIP_SAVE','SKIP_PRESET']))
+    rects: bpy.props.StringProperty(
+        name="Rectangles",
+        description="JSON list of the rectangles committed by a chain, replayed on redo",
+        options=set(['HIDDEN','SKIP_SAVE','SKIP_PRESET']))
     renderer = None
 
     @classmethod
@@ -62,52 +85,167 @@ class SHIRAKUMO_RECT_OT_draw_rectangle(bpy.types.Operator):
             return True
         return False
 
+    def object(self, context):
+        ## The gizmo may pick an edge on any object that we can extend, not
+        ## just the active one.
+        object = bpy.data.objects.get(self.target) if self.target else None
+        return context.object if object is None else object
+
     def snap(self, thing):
         basis = Matrix.Identity(4)
         if self.grid_basis == "VIEW":
             basis = bpy.context.region_data.view_matrix
         if self.grid_basis == "LOCAL":
-            basis = bpy.context.object.matrix_world
+            basis = self.object(bpy.context).matrix_world
         if self.grid_basis == "NORMAL":
-            raise Exception("IMPLEMENT ME!")
+            basis = self.normal_basis()
         return snap_to_grid(thing, self.grid, basis)
 
+    def normal_basis(self):
+        ## The frame of the face on the start edge, or of the face closest
+        ## to the start if the edge has none. Like our points it is in
+        ## object space.
+        mt = self.mt
+        face = None
+        if self.edge < len(mt.mesh.edges):
+            faces = mt.mesh.edges[self.edge].link_faces
+            if faces:
+                face = faces[0]
+        if face is None and mt.mesh.faces:
+            i = mt.ensure_index('faces', wait=True).find(Vector(self.start), mt.mesh)
+            if i is not None:
+                face = mt.mesh.faces[i]
+        frame = None if face is None else mt.face_frame(face)
+        return Matrix.Identity(4) if frame is None else frame
+
     def update(self, context, event):
-        mouse_pos = (event.mouse_region_x, event.mouse_region_y)
-        self.end = mouse_position_3d(context, mouse_pos, self.start_orig)
-        self.end = context.object.matrix_world.inverted_safe() @ self.end
-        if event.ctrl:
-            diff = edge_snap(self.edge_data, self.end)-self.start_orig
-            self.start = self.start_orig-diff
+        with profiling.phase("update"):
+            mouse_pos = (event.mouse_region_x, event.mouse_region_y)
+            self.end = mouse_position_3d(context, mouse_pos, self.start_orig)
+            self.end = self.mt.to_local @ self.end
+            target = self.snap_target(context, mouse_pos)
+            self.snapped = target is not None
+            if self.snapped:
+                self.end = target
+            if event.ctrl:
+                diff = edge_snap(self.edge_data, self.end)-self.start_orig
+                self.start = self.start_orig-diff
+
+    def snap_target(self, context, mouse_pos):
+        ## Converts the pixel radius to object space at the depth of the
+        ## drag plane, then asks the session's point indices.
+        if self.snap_radius == 0:
+            return None
+        x,y = mouse_pos
+        a = self.mt.to_local @ mouse_position_3d(context, (x, y), self.start_orig)
+        b = self.mt.to_local @ mouse_position_3d(context, (x+self.snap_radius, y), self.start_orig)
+        return self.mt.snap_target(Vector(self.end), (b-a).length)
+
+    def snap_end(self):
+        ## Ends on existing geometry stay put rather than going to the grid.
+        return Vector(self.end) if self.snapped else self.snap(self.end)
 
     def modal(self, context, event):
-        if event.type == 'MOUSEMOVE':
-            self.update(context, event)
-            context.area.tag_redraw()
-        elif event.type == 'LEFTMOUSE':
-            self.update(context, event)
-            return self.execute(context)
-        elif event.type == 'RIGHTMOUSE':
-            return {'CANCELLED'}
-        elif event.type in {'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE'}:
-            return {'PASS_THROUGH'}
-        return {'RUNNING_MODAL'}
+        with profiling.phase("modal"):
+            if event.type == 'MOUSEMOVE':
+                if self.dragging:
+                    self.update(context, event)
+                else:
+                    self.hover(context, event)
+                context.area.tag_redraw()
+            elif event.type == 'LEFTMOUSE':
+                if not self.chain:
+                    self.update(context, event)
+                    return self.execute(context)
+                if self.dragging and event.value == 'RELEASE':
+                    self.update(context, event)
+                    self.commit_chained(context)
+                elif not self.dragging and event.value == 'PRESS' and self.hover(context, event):
+                    self.begin(context)
+                context.area.tag_redraw()
+            elif event.type in {'RIGHTMOUSE', 'ESC'}:
+                if self.chain and self.dragging:
+                    ## Only drop the rectangle in progress.
+                    self.dragging = False
+                    context.area.tag_redraw()
+                elif self.chain and self.committed:
+                    return self.finish(context)
+                else:
+                    self.cancel(context)
+                    return {'CANCELLED'}
+            elif event.type in {'RET', 'NUMPAD_ENTER', 'SPACE'} and self.chain and event.value == 'PRESS':
+                if self.dragging:
+                    self.update(context, event)
+                    self.commit_chained(context)
+                return self.finish(context)
+            elif event.type in {'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE'}:
+                return {'PASS_THROUGH'}
+            return {'RUNNING_MODAL'}
 
-    def ensure_edge_data(self, context):
+    def hover(self, context, event):
+        ## Picks the edge to start the next chained rectangle from.
+        mouse_pos = (event.mouse_region_x, event.mouse_region_y)
+        point = self.mt.from_mouse(context, mouse_pos)
+        self.mt.index_ready('edges', wait=True)
+        res = self.mt.closest_edge(point)
+        if res is None:
+            self.edge = self.mt.counts()[1]
+            self.start = point
+        else:
+            e,d,p,f = res
+            self.edge = e.index
+            self.start = p
+        self.end = self.start
+        return True
+
+    def begin(self, context):
+        self.start_orig = self.start.copy()
         if hasattr(self, 'edge_data'):
+            del self.edge_data
+        self.ensure_edge_data(context)
+        self.snapped = False
+        self.dragging = True
+
+    def commit_chained(self, context):
+        ## Commits into the live bmesh without syncing, the mesh is only
+        ## written back once in finish.
+        res = self.commit(self.mt)
+        self.dragging = False
+        if res is None:
             return
-        if context.object.data.is_editmode:
-            mesh = bmesh.from_edit_mesh(context.object.data)
+        self.committed.append(res)
+        ## Remember the rectangle as drawn, so that a redo can replay them.
+        rects = json.loads(self.rects or "[]")
+        rects.append({"edge": self.edge, "start": list(self.start), "end": list(self.end), "snapped": self.snapped})
+        self.rects = json.dumps(rects)
+        self.mt.commit()
+        if self.mt.mesh.is_wrapped:
+            bmesh.update_edit_mesh(self.mt.object.data, loop_triangles=True, destructive=True)
         else:
-            mesh = bmesh.new()
-            mesh.from_mesh(context.object.data)
-        mesh.edges.ensure_lookup_table()
-        if len(mesh.edges) <= self.edge:
-            edge = FakeEdge(self.start)
+            c1,c2,c3,c4 = self.corners()
+            self.preview.committed.append((c1,c2,c3,c4))
+
+    def select_committed(self):
+        if self.committed:
+            self.mt.select([ e for r in self.committed for e in (r[1] if hasattr(r[1], '__iter__') else [r[1]]) if e is not None and e.is_valid ])
+
+    def finish(self, context):
+        ## Release the session before the sync, so that it may let go of the
+        ## bmesh in object mode.
+        self.select_committed()
+        self.cancel(context)
+        self.mt.sync()
+        return {'FINISHED'} if self.committed else {'CANCELLED'}
+
+    def ensure_edge_data(self, context):
+        if hasattr(self, 'edge_data'):
+            return
+        self.mt = session(self.object(context))
+        coords = self.mt.edge_coords(self.edge)
+        if coords is None:
+            self.edge_data = FakeEdge(Vector(self.start))
         else:
-            edge = mesh.edges[self.edge]
-        self.edge_data = FakeEdge(edge.verts[0].co, edge.verts[1].co)
-        mesh.free()
+            self.edge_data = FakeEdge(*coords)
 
     def invoke(self, context, event):
         edit_type = context.scene.transform_orientation_slots[0].type
@@ -115,14 +253,17 @@ class SHIRAKUMO_RECT_OT_draw_rectangle(bpy.types.Operator):
             self.grid_basis = edit_type
         self.start_orig = self.start.copy()
         self.ensure_edge_data(context)
+        self.dragging = True
+        self.committed = []
+        self.mt.held = self.chain
+        self.preview = render.Preview()
         self.renderer = bpy.types.SpaceView3D.draw_handler_add(self.render, (context,), "WINDOW", "POST_VIEW")
         context.window_manager.modal_handler_add(self)
         return {'RUNNING_MODAL'}
 
-    def execute(self, context):
+    def commit(self, mt):
         start = self.snap(self.start)
-        end = self.snap(self.end)
-        mt = MeshTools(context.object)
+        end = self.snap_end()
         edge = None
         if self.edge < len(mt.mesh.edges):
             edge = mt.mesh.edges[self.edge]
@@ -130,29 +271,120 @@ class SHIRAKUMO_RECT_OT_draw_rectangle(bpy.types.Operator):
             if (end_edge-self.start).length == 0.0:
                 start = edge.verts[0].co
                 end = edge.verts[1].co+(self.end-end_edge)
-        res = mt.create_rect(edge, start, end, dissolve_verts=self.dissolve_verts)
-        if res is not None:
-            mt.select(res[1])
-        mt.free(sync=True)
-        if self.renderer:
-            bpy.types.SpaceView3D.draw_handler_remove(self.renderer, "WINDOW")
-            self.renderer = None
-        return {'FINISHED'}
+        return mt.create_rect(edge, start, end, dissolve_verts=self.dissolve_verts)
+
+    def execute(self, context):
+        with profiling.phase("execute", profile=True):
+            self.mt = mt = session(self.object(context))
+            if self.rects:
+                ## Redoing a chain, which replays all of its rectangles in
+                ## order, so their edge indices line up again.
+                self.committed = []
+                for rect in json.loads(self.rects):
+                    self.edge = rect["edge"]
+                    self.start = rect["start"]
+                    self.end = rect["end"]
+                    self.snapped = rect["snapped"]
+                    res = self.commit(mt)
+                    if res is not None:
+                        self.committed.append(res)
+                        mt.commit()
+                self.select_committed()
+            else:
+                res = self.commit(mt)
+                if res is not None:
+                    mt.select(res[1])
+            mt.sync()
+            self.cancel(context)
+            return {'FINISHED'}
 
     def cancel(self, context):
+        if hasattr(self, 'mt'):
+            self.mt.held = False
         if self.renderer:
             bpy.types.SpaceView3D.draw_handler_remove(self.renderer, "WINDOW")
             self.renderer = None
 
-    def render(self, context):
-        ## FIXME: account for object transform
-        world = context.object.matrix_world
+    def corners(self):
         edge = self.edge_data
         c1 = edge_snap(edge, self.snap(self.start))
-        c3 = self.snap(self.end)
+        c3 = self.snap_end()
         c2 = edge_snap(edge, c3)
         c4 = c3+(c1-c2)
-        render.rect(context, [*c1, *c2, *c3, *c4], world)
+        return c1,c2,c3,c4
+
+    def render(self, context):
+        ## Everything is computed in object space, like in execute, and
+        ## transformed by the object's matrix on draw.
+        if not self.dragging:
+            if self.preview.committed:
+                self.preview.update(('IDLE', len(self.preview.committed)))
+                self.preview.draw(context, self.mt.object.matrix_world)
+            return
+        c1,c2,c3,c4 = self.corners()
+        key = (tuple(c1), tuple(c3), self.dissolve_verts, len(self.preview.committed))
+        if key != self.preview.key:
+            path = self.mt.rect_path(self.edge, c1, c2)
+            ghosts = [] if self.dissolve_verts else [ p+(c3-c2) for p in path ]
+            self.preview.update(key, c1, c2, c3, c4, path, ghosts)
+        self.preview.draw(context, self.mt.object.matrix_world)
+
+class SHIRAKUMO_RECT_OT_snap_to_grid(bpy.types.Operator):
+    bl_idname = "mesh.snap_to_rectangle_grid"
+    bl_label = "Snap to rectangle grid"
+    bl_options = {'REGISTER', 'UNDO'}
+    bl_description = "Snap vertices back onto the rectangle tool's grid"
+
+    grid: bpy.props.FloatProperty(
+        name="Grid",
+        default=0.1, min=0.0, options=set(),
+        description="The grid size used for snapping")
+    grid_basis: bpy.props.EnumProperty(
+        name="Basis",
+        items=[
+            ("GLOBAL", "Global", "Snap to global coordinates", "ORIENTATION_GLOBAL", 1),
+            ("LOCAL", "Local", "Snap to the object's transform", "ORIENTATION_LOCAL", 3),
+        ],
+        default="GLOBAL",
+        description="The basis to grid snap relative to")
+    selected_only: bpy.props.BoolProperty(
+        name="Selected Only",
+        default=True, options=set(),
+        description="Only snap selected vertices. Ignored in object mode")
+
+    @classmethod
+    def poll(cls, context):
+        return (context.object is not None and context.object.type == 'MESH')
+
+    def invoke(self, context, event):
+        self.grid = preferences().grid
+        return self.execute(context)
+
+    def execute(self, context):
+        object = context.object
+        edit = object.mode == 'EDIT'
+        ## Going through the mesh lets us use foreach_get rather than bmesh.
+        if edit:
+            bpy.ops.object.mode_set(mode='OBJECT')
+        data = object.data
+        co = arrays.mesh_coords(data)
+        basis = object.matrix_world if self.grid_basis == "LOCAL" else Matrix.Identity(4)
+        snapped = arrays.snap_to_grid(co, self.grid, basis)
+        if edit and self.selected_only:
+            sel = arrays.mesh_selection(data)
+            co[sel] = snapped[sel]
+            count = int(sel.sum())
+        else:
+            co = snapped
+            count = len(co)
+        arrays.set_mesh_coords(data, co)
+        if edit:
+            bpy.ops.object.mode_set(mode='EDIT')
+        self.report({'INFO'}, f"Snapped {count} vertices")
+        return {'FINISHED'}
+
+## Size of the screen cells within which hover queries are reused.
+hover_pixels = 3
 
 class SHIRAKUMO_RECT_G_rectangle_preselect(bpy.types.Gizmo):
     bl_idname = "SHIRAKUMO_RECT_G_rectangle_preselect"
@@ -173,18 +405,28 @@ class SHIRAKUMO_RECT_G_rectangle_preselect(bpy.types.Gizmo):
         self.edge = None
         self.select = True
         self.edgepoint = None
+        self.hover_key = None
+        self.building = False
+        self.mt = None
         self.op = self.target_set_operator(SHIRAKUMO_RECT_OT_draw_rectangle.bl_idname)
 
     def exit(self, context, cancel):
+        if self.building:
+            self.building = False
+            context.workspace.status_text_set(None)
         self.edge = None
         self.edgepoint = None
+        self.hover_key = None
+        self.mt = None
     
     def draw(self, context):
-        world = context.object.matrix_world
+        if self.mt is None or not self.mt.valid():
+            return
+        world = self.mt.object.matrix_world
         if self.edgepoint is not None:
             mat = Matrix.Translation(self.edgepoint)
             self.draw_custom_shape(self.point, matrix=(world @ mat))
-        if self.edge is not None:
+        if self.edge is not None and self.edge.is_valid:
             r = edge_rotation(self.edge)
             mat = Matrix.Translation(self.edge.verts[0].co)
             mat = mat @ r.to_matrix().to_4x4()
@@ -192,22 +434,69 @@ class SHIRAKUMO_RECT_G_rectangle_preselect(bpy.types.Gizmo):
             self.draw_custom_shape(self.line, matrix=(world @ mat))
 
     def test_select(self, context, mouse_pos):
-        res = self.group.mt.closest_edge_view(context, mouse_pos)
-        if res is None:
-            p = self.group.mt.from_mouse(context, mouse_pos)
-            self.edge = None
-            self.op.edge = 0
-        else:
-            e,d,p,f = res
-            self.edge = e
-            self.op.edge = e.index
-        self.op.start = p
-        self.op.grid = preferences().grid
-        p = snap_to_grid(p, preferences().grid)
-        if self.edge:
-            self.edgepoint = edge_snap(self.edge, p)
-        context.area.tag_redraw()
-        return 0
+        with profiling.phase("test_select"):
+            prefs = preferences()
+            grid = prefs.grid
+            point = mouse_position_3d(context, mouse_pos)
+            ## Only re-query the indices if the view, the scene, or the few
+            ## pixels under the cursor changed since last time. The nearest
+            ## edge depends on the unsnapped position, so this can't be any
+            ## coarser without the highlight lagging behind the cursor.
+            cell = (int(mouse_pos[0]) // hover_pixels, int(mouse_pos[1]) // hover_pixels)
+            key = (context.region_data.perspective_matrix.copy(), scene_version(), cell)
+            mt = self.mt
+            if key == self.hover_key and mt is not None and mt.valid() and (self.edge is None or self.edge.is_valid):
+                profiling.count("hover_hits")
+                e = self.edge
+                local = mt.to_local @ point
+                p = local if e is None else edge_snap(e, local)
+            else:
+                profiling.count("hover_misses")
+                objects = pick_objects(context)
+                best, building = pick_edge(objects, point)
+                ## Don't offer anything to click on until an index is ready.
+                if best is None and building:
+                    if not self.building:
+                        self.building = True
+                        self.edge = None
+                        self.edgepoint = None
+                        context.workspace.status_text_set("Building rectangle index...")
+                        context.area.tag_redraw()
+                    return -1
+                if self.building:
+                    self.building = False
+                    context.workspace.status_text_set(None)
+                ## Keep the key while indices are building, so we ask again.
+                self.hover_key = None if building else key
+                if best is None:
+                    ## Without an edge we draw on the active object, unless
+                    ## it is one we can't extend either.
+                    mt = self.group.mt
+                    if mt.object not in objects:
+                        if self.edge is not None or self.edgepoint is not None:
+                            context.area.tag_redraw()
+                        self.mt = None
+                        self.edge = None
+                        self.edgepoint = None
+                        return -1
+                    e,p = None,mt.to_local @ point
+                else:
+                    mt,(e,d,p,f) = best
+            self.mt = mt
+            self.op.target = mt.object.name
+            self.op.edge = mt.counts()[1] if e is None else e.index
+            self.op.start = p
+            self.op.grid = grid
+            self.op.chain = prefs.chain
+            self.op.snap_radius = prefs.snap_radius
+            p = snap_to_grid(p, grid)
+            edgepoint = self.edgepoint if e is None else edge_snap(e, p)
+            if e != self.edge or edgepoint != self.edgepoint:
+                self.edge = e
+                self.edgepoint = edgepoint
+                profiling.count("hover_redraws")
+                context.area.tag_redraw()
+            return 0
 
 class SHIRAKUMO_RECT_GG_rectangle(bpy.types.GizmoGroup):
     bl_idname = "SHIRAKUMO_RECT_GG_rectangle"
@@ -215,19 +504,20 @@ class SHIRAKUMO_RECT_GG_rectangle(bpy.types.GizmoGroup):
     bl_space_type = 'VIEW_3D'
     bl_region_type = 'WINDOW'
     bl_options = {'3D', 'SELECT'}
-    mt = None
 
     @classmethod
     def poll(self, context):
         return (context.object is not None and context.object.type == 'MESH')
 
     def refresh(self, context):
-        if self.mt is not None:
-            self.mt.refresh()
+        ## Sessions are cached per object and only refreshed if the depsgraph
+        ## reported changes, so this is cheap when nothing happened.
+        self.mt = session(context.object)
 
     def setup(self, context):
-        if self.mt is None:
-            self.mt = MeshTools(context.object)
+        self.mt = session(context.object)
+        ## Get the index going while the user is still moving to the mesh.
+        self.mt.index_ready('edges')
         self.gizmo_dial = self.gizmos.new("SHIRAKUMO_RECT_G_rectangle_preselect")
 
     def draw_prepare(self, context):
@@ -250,6 +540,8 @@ class SHIRAKUMO_RECT_WT_rectangle(bpy.types.WorkSpaceTool):
 
     def draw_settings(context, layout, tool):
         layout.prop(preferences(), "grid")
+        layout.prop(preferences(), "chain")
+        layout.prop(preferences(), "snap_radius")
 
 class SHIRAKUMO_RECT_WT_rectangle_OBJECT(SHIRAKUMO_RECT_WT_rectangle):
     bl_context_mode = 'OBJECT'
@@ -260,17 +552,58 @@ class SHIRAKUMO_RECT_properties(bpy.types.AddonPreferences):
         name="Grid",
         default=0.1, min=0.0, options=set(),
         description="The grid size used for snapping.")
+    chain: bpy.props.BoolProperty(
+        name="Chain",
+        default=False, options=set(),
+        description="Keep drawing rectangles until confirmed with Enter, as a single undo step")
+    snap_radius: bpy.props.IntProperty(
+        name="Snap Radius",
+        default=12, min=0, subtype='PIXEL', options=set(),
+        description="Distance in pixels within which the end point snaps to vertices and edge midpoints, 0 to disable")
+
+    profiling: bpy.props.BoolProperty(
+        name="Collect Timings",
+        default=False, options=set(),
+        update=lambda self, context: profiling.set_enabled(self.profiling),
+        description="Whether to collect timings of the tool's hot paths")
+
+    def draw(self, context):
+        self.layout.prop(self, "grid")
+        self.layout.prop(self, "chain")
+        self.layout.prop(self, "snap_radius")
+        self.layout.prop(self, "profiling")
 
 registered_classes = [
     SHIRAKUMO_RECT_OT_draw_rectangle,
+    SHIRAKUMO_RECT_OT_snap_to_grid,
     SHIRAKUMO_RECT_G_rectangle_preselect,
     SHIRAKUMO_RECT_GG_rectangle,
     SHIRAKUMO_RECT_properties,
 ]
 
+@bpy.app.handlers.persistent
+def release_sessions_handler(*args):
+    release_sessions()
+
+@bpy.app.handlers.persistent
+def depsgraph_update_handler(scene, depsgraph):
+    note_updates(depsgraph)
+
+@bpy.app.handlers.persistent
+def undo_handler(*args):
+    note_undo()
+
 def register():
     for cls in registered_classes:
         bpy.utils.register_class(cls)
+    bpy.app.handlers.load_pre.append(release_sessions_handler)
+    bpy.app.handlers.depsgraph_update_post.append(depsgraph_update_handler)
+    bpy.app.handlers.undo_post.append(undo_handler)
+    bpy.app.handlers.redo_post.append(undo_handler)
+    try:
+        profiling.set_enabled(preferences().profiling)
+    except KeyError:
+        pass
     bpy.utils.register_tool(SHIRAKUMO_RECT_WT_rectangle, after={'builtin.poly_build'})
     ## KLUDGE: Can't seem to enter the tool after the group builtin.primitive_cube_add creates, it just
     ##         always wants to insert the tool into that group. Fun. I could make it into a group, but
@@ -278,6 +611,11 @@ def register():
     bpy.utils.register_tool(SHIRAKUMO_RECT_WT_rectangle_OBJECT, after={'builtin.measure'}, separator=True)
 
 def unregister():
+    bpy.app.handlers.load_pre.remove(release_sessions_handler)
+    bpy.app.handlers.depsgraph_update_post.remove(depsgraph_update_handler)
+    bpy.app.handlers.undo_post.remove(undo_handler)
+    bpy.app.handlers.redo_post.remove(undo_handler)
+    release_sessions()
     bpy.utils.unregister_tool(SHIRAKUMO_RECT_WT_rectangle)
     bpy.utils.unregister_tool(SHIRAKUMO_RECT_WT_rectangle_OBJECT)
     for cls in registered_classes:
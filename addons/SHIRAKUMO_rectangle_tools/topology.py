@@ -0,0 +1,337 @@
+import heapq
+import math
+import numpy as np
+from bisect import bisect_right
+from .arrays import line_factors, line_distances, mesh_arrays
+
+## This module only depends on NumPy, so that the graph queries can be used
+## and tested outside of Blender as well.
+
+class Chain():
+    ## A run of collinear edges, ordered along DIR, with the parameter of
+    ## every vertex along DIR from ORIGIN. Edge i runs from verts[i] to
+    ## verts[i+1], so the edge containing the projection of a point is found
+    ## by binary search over the parameters.
+    def __init__(self, origin, dir, verts, edges, ts):
+        self.origin = origin
+        self.dir = dir
+        self.verts = verts
+        self.edges = edges
+        self.ts = ts
+        self.position = { e: i for i,e in enumerate(edges) }
+
+    def param(self, p):
+        return float(np.dot(p - self.origin, self.dir))
+
+    def find(self, t):
+        ## Index of the edge containing parameter T, or None if it is past
+        ## either end.
+        ts = self.ts
+        if t < ts[0] or ts[-1] < t:
+            return None
+        return min(bisect_right(ts, t) - 1, len(self.edges) - 1)
+
+class Topology():
+    ## Vertex coordinates and edges in flat arrays, with the vertex to edge
+    ## adjacency in CSR form. Edits are recorded as per vertex overrides of
+    ## the adjacency until there are enough of them to warrant rebuilding
+    ## the CSR arrays.
+    def __init__(self, co, edges, churn=0.25):
+        co = np.asarray(co, dtype=np.float64).reshape(-1,3)
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1,2)
+        self.nv = len(co)
+        self.ne = len(edges)
+        self.co = co.copy()
+        self.edges = edges.copy()
+        self.churn = churn
+        self.rebuilds = 0
+        ## Collinear chains are found on demand, and shared by all their
+        ## edges and verts.
+        self.chains = {}
+        self.vert_chains = {}
+        self.rebuild()
+
+    @classmethod
+    def from_mesh(cls, data, churn=0.25):
+        return cls(*mesh_arrays(data), churn)
+
+    def rebuild(self):
+        ends = self.edges[:self.ne].ravel()
+        ids = np.repeat(np.arange(self.ne, dtype=np.int64), 2)
+        order = np.argsort(ends, kind='stable')
+        self.adjacency = ids[order]
+        self.offsets = np.zeros(self.nv+1, dtype=np.int64)
+        np.cumsum(np.bincount(ends, minlength=self.nv), out=self.offsets[1:])
+        self.built = self.nv
+        self.overrides = {}
+        self.rebuilds += 1
+
+    def link_edges(self, v):
+        edges = self.overrides.get(v)
+        if edges is not None:
+            return edges
+        if self.built <= v:
+            return []
+        return self.adjacency[self.offsets[v]:self.offsets[v+1]].tolist()
+
+    def other_vert(self, e, v):
+        a,b = self.edges[e]
+        return int(b if a == v else a)
+
+    def edge_verts(self, e):
+        a,b = self.edges[e]
+        return int(a), int(b)
+
+    def edge_factor(self, e, p):
+        a,b = self.edges[e]
+        return float(line_factors(np.asarray(p, dtype=np.float64)[None], self.co[a][None], self.co[b][None])[0])
+
+    ## Editing
+
+    def grow(self, array, n):
+        if n <= len(array):
+            return array
+        grown = np.empty((max(n, 2*len(array)), array.shape[1]), dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def override(self, v):
+        edges = self.overrides.get(v)
+        if edges is None:
+            edges = self.overrides[v] = self.link_edges(v)
+        return edges
+
+    def add_vertex(self, co):
+        self.co = self.grow(self.co, self.nv+1)
+        self.co[self.nv] = co
+        self.overrides[self.nv] = []
+        self.nv += 1
+        return self.nv-1
+
+    def set_co(self, v, co):
+        if v in self.vert_chains and not np.array_equal(self.co[v], co):
+            self.drop_chains(v)
+        self.co[v] = co
+
+    def add_edge(self, a, b):
+        self.edges = self.grow(self.edges, self.ne+1)
+        self.edges[self.ne] = (a,b)
+        self.override(a).append(self.ne)
+        self.override(b).append(self.ne)
+        self.ne += 1
+        self.compact()
+        return self.ne-1
+
+    def set_edge(self, e, a, b):
+        oa,ob = self.edge_verts(e)
+        if (oa,ob) == (a,b):
+            return
+        chain = self.chains.get(e)
+        if chain is not None and not self.split_chain(chain, e, oa, ob, a, b):
+            self.drop_chain(chain)
+        for v in (oa,ob):
+            edges = self.override(v)
+            if e in edges:
+                edges.remove(e)
+        self.edges[e] = (a,b)
+        self.override(a).append(e)
+        self.override(b).append(e)
+        self.compact()
+
+    def compact(self):
+        if max(1, self.built) * self.churn < len(self.overrides):
+            self.rebuild()
+
+    ## Chains
+
+    def chain(self, e, tolerance=0.999):
+        ## Returns the maximal chain of edges collinear with E, within
+        ## TOLERANCE as the cosine of the angle between them.
+        chain = self.chains.get(e)
+        if chain is not None:
+            return chain
+        a,b = self.edge_verts(e)
+        dir = self.co[b] - self.co[a]
+        length = np.linalg.norm(dir)
+        if length == 0.0:
+            return None
+        dir = dir / length
+        ahead = self.extend_chain(e, b, dir, tolerance)
+        behind = self.extend_chain(e, a, -dir, tolerance)
+        verts = [ v for v,_ in reversed(behind) ] + [a, b] + [ v for v,_ in ahead ]
+        edges = [ e for _,e in reversed(behind) ] + [e] + [ e for _,e in ahead ]
+        origin = self.co[a].copy()
+        ts = ((self.co[verts] - origin) @ dir).tolist()
+        chain = Chain(origin, dir, verts, edges, ts)
+        for c in edges:
+            self.chains[c] = chain
+        for v in verts:
+            self.vert_chains.setdefault(v, []).append(chain)
+        return chain
+
+    def extend_chain(self, e, v, dir, tolerance):
+        ## Walks from V along DIR for as long as there is exactly one edge
+        ## continuing in that direction.
+        steps = []
+        seen = set([e])
+        while True:
+            edges = np.array([ c for c in self.link_edges(v) if c not in seen ], dtype=np.int64)
+            if len(edges) == 0:
+                return steps
+            ends = self.edges[edges]
+            others = np.where(ends[:,0] == v, ends[:,1], ends[:,0])
+            d = self.co[others] - self.co[v]
+            n = np.linalg.norm(d, axis=1)
+            ok = (d @ dir) >= tolerance * n
+            ok &= n > 0.0
+            if np.count_nonzero(ok) != 1:
+                return steps
+            i = int(np.argmax(ok))
+            e, v = int(edges[i]), int(others[i])
+            seen.add(e)
+            steps.append((v, e))
+
+    def split_chain(self, chain, e, oa, ob, a, b):
+        ## Handles E going from (OA,OB) to (A,B) because a vertex was inserted
+        ## into it, in which case the other half was already added as a new
+        ## edge. Returns false if this is not such a split.
+        i = chain.position[e]
+        lo,hi = chain.verts[i], chain.verts[i+1]
+        if (a == lo) + (b == lo) + (a == hi) + (b == hi) != 1:
+            return False
+        kept = lo if lo in (a,b) else hi
+        lost = hi if kept == lo else lo
+        w = b if a == kept else a
+        if w in self.vert_chains:
+            return False
+        t = chain.param(self.co[w])
+        if not (chain.ts[i] < t < chain.ts[i+1]):
+            return False
+        ## The new vertex must actually lie on the chain's line.
+        offset = self.co[w] - (chain.origin + t * chain.dir)
+        if 1e-5 * max(1.0, chain.ts[i+1] - chain.ts[i]) < np.linalg.norm(offset):
+            return False
+        other = [ c for c in self.link_edges(w) if c != e and self.other_vert(c, w) == lost ]
+        if len(other) != 1 or other[0] in self.chains:
+            return False
+        other = other[0]
+        halves = [e, other] if kept == lo else [other, e]
+        chain.verts.insert(i+1, w)
+        chain.ts.insert(i+1, t)
+        chain.edges[i:i+1] = halves
+        chain.position = { c: j for j,c in enumerate(chain.edges) }
+        self.chains[other] = chain
+        self.vert_chains[w] = [chain]
+        return True
+
+    def drop_chain(self, chain):
+        for e in chain.edges:
+            if self.chains.get(e) is chain:
+                del self.chains[e]
+        for v in chain.verts:
+            chains = self.vert_chains.get(v)
+            if chains is not None and chain in chains:
+                chains.remove(chain)
+                if not chains:
+                    del self.vert_chains[v]
+
+    def drop_chains(self, v):
+        for chain in list(self.vert_chains.get(v, ())):
+            self.drop_chain(chain)
+
+    ## Queries
+
+    def closest_connected_edge(self, e, point):
+        ## Walk from E along roughly collinear edges until we reach the edge
+        ## that contains the projection of POINT. Straight runs are skipped
+        ## through their chain, so the walk only starts where a run ends.
+        point = np.asarray(point, dtype=np.float64)
+        chain = self.chain(e)
+        if chain is not None:
+            t = chain.param(point)
+            i = chain.position[e]
+            if chain.ts[i] <= t <= chain.ts[i+1]:
+                return e
+            i = chain.find(t)
+            if i is not None:
+                return chain.edges[i]
+            e = chain.edges[0] if t < chain.ts[0] else chain.edges[-1]
+        f = self.edge_factor(e, point)
+        a,b = self.edge_verts(e)
+        dir = self.co[b] - self.co[a]
+        dir = dir / (np.linalg.norm(dir) or 1.0)
+        if f < 0:
+            dir = -dir
+        while (f < 0 or 1 < f):
+            v = a if f < 0.5 else b
+            edges = np.array([ c for c in self.link_edges(v) if c != e ], dtype=np.int64)
+            if len(edges) == 0:
+                break
+            ends = self.edges[edges]
+            others = np.where(ends[:,0] == v, ends[:,1], ends[:,0])
+            d = self.co[others] - self.co[v]
+            n = np.linalg.norm(d, axis=1)
+            ## Don't consider edges that bend away from our principal direction
+            ok = (d @ dir) > 0.1 * np.where(n == 0.0, 1.0, n)
+            if not ok.any():
+                break
+            edges, ends = edges[ok], ends[ok]
+            dist = line_distances(np.broadcast_to(point, (len(edges),3)), self.co[ends[:,0]], self.co[ends[:,1]])
+            e = int(edges[np.argmin(dist)])
+            a,b = self.edge_verts(e)
+            f = self.edge_factor(e, point)
+        return e
+
+    def edge_path(self, start, end, restrict=False):
+        ## Returns the list of edges on the shortest path from START to END,
+        ## ordered from END to START, or None if there is none. See
+        ## MeshTools.edge_path for RESTRICT.
+        if start == end:
+            return []
+        co = self.co
+        goal = co[end]
+        bounds = None
+        if restrict:
+            dir = goal - co[start]
+            length = np.linalg.norm(dir)
+            dir = dir / (length or 1.0)
+            eps = 1e-4 * max(1.0, length)
+            bounds = (np.minimum(co[start], goal) - eps, np.maximum(co[start], goal) + eps)
+        prev = {}
+        dist = {start: 0.0}
+        visited = set()
+        queue = [(float(np.linalg.norm(goal - co[start])), start)]
+        while queue:
+            _, u = heapq.heappop(queue)
+            if u == end:
+                edges = []
+                while u != start:
+                    u,e = prev[u]
+                    edges.append(e)
+                return edges
+            if u in visited:
+                continue
+            visited.add(u)
+            edges = np.array(self.link_edges(u), dtype=np.int64)
+            if len(edges) == 0:
+                continue
+            ends = self.edges[edges]
+            others = np.where(ends[:,0] == u, ends[:,1], ends[:,0])
+            d = co[others] - co[u]
+            lengths = np.linalg.norm(d, axis=1)
+            if bounds is not None:
+                ok = np.abs(d @ dir) >= 0.999 * lengths
+                ok &= np.all((bounds[0] <= co[others]) & (co[others] <= bounds[1]), axis=1)
+                ok &= lengths > 0.0
+                edges, others, lengths = edges[ok], others[ok], lengths[ok]
+            heuristic = np.linalg.norm(goal - co[others], axis=1)
+            du = dist[u]
+            for e,v,l,h in zip(edges.tolist(), others.tolist(), lengths.tolist(), heuristic.tolist()):
+                if v in visited:
+                    continue
+                alt = du + l
+                if alt < dist.get(v, math.inf):
+                    prev[v] = (u,e)
+                    dist[v] = alt
+                    heapq.heappush(queue, (alt + h, v))
+        return None
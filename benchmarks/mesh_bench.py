@@ -0,0 +1,177 @@
+## Benchmarks for the MeshTools hot paths. Run with
+##   blender --background --factory-startup --python benchmarks/mesh_bench.py -- [options]
+## See --help for the options. Results are written as JSON, and can be
+## compared against a stored baseline to catch regressions.
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import bpy
+import numpy as np
+from mathutils import Vector
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "addons"))
+from SHIRAKUMO_rectangle_tools.mesh import MeshTools
+
+def quad_mesh(name, cells):
+    ## CELLS is an (N,2) integer array of unit cell coordinates to fill.
+    cells = np.asarray(cells, dtype=np.int64)
+    w = int(cells[:,0].max()) + 2
+    corners = np.stack([cells, cells+(1,0), cells+(1,1), cells+(0,1)], axis=1).reshape(-1,2)
+    keys = corners[:,1]*w + corners[:,0]
+    used, loops = np.unique(keys, return_inverse=True)
+    co = np.zeros((len(used),3), dtype=np.float32)
+    co[:,0] = (used % w) * 0.1
+    co[:,1] = (used // w) * 0.1
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(co))
+    mesh.vertices.foreach_set("co", co.ravel())
+    mesh.loops.add(len(loops))
+    mesh.loops.foreach_set("vertex_index", loops.astype(np.int32))
+    mesh.polygons.add(len(cells))
+    mesh.polygons.foreach_set("loop_start", np.arange(0, len(loops), 4, dtype=np.int32))
+    mesh.update(calc_edges=True)
+    object = bpy.data.objects.new(name, mesh)
+    bpy.context.scene.collection.objects.link(object)
+    return object
+
+def grid_cells(faces):
+    n = max(1, int(math.sqrt(faces)))
+    x,y = np.meshgrid(np.arange(n), np.arange(n))
+    return np.stack([x.ravel(), y.ravel()], axis=1)
+
+def strip_cells(faces):
+    return np.stack([np.arange(faces), np.zeros(faces, dtype=np.int64)], axis=1)
+
+def city_cells(faces, block=8):
+    ## Blocks of BLOCKxBLOCK cells separated by one cell wide streets.
+    n = max(block+1, int(math.sqrt(faces * ((block+1)/block)**2)))
+    cells = grid_cells(n*n)
+    keep = ((cells[:,0] % (block+1)) != block) & ((cells[:,1] % (block+1)) != block)
+    return cells[keep]
+
+shapes = {
+    "grid": grid_cells,
+    "strip": strip_cells,
+    "city": city_cells,
+}
+
+def timed(fun, repeat=1):
+    best = math.inf
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fun()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+def bounds(mt):
+    co = [ v.co for v in mt.mesh.verts ]
+    return (Vector([min(c[i] for c in co) for i in range(3)]),
+            Vector([max(c[i] for c in co) for i in range(3)]))
+
+def boundary_edge(mt, dir=Vector([1,0,0])):
+    ## Longest-running boundary edge along DIR at the bottom of the mesh.
+    lo,hi = bounds(mt)
+    for e in mt.mesh.edges:
+        if e.is_boundary and abs((e.verts[1].co-e.verts[0].co).normalized().dot(dir)) > 0.99 and e.verts[0].co.y == lo.y:
+            return e
+    return mt.mesh.edges[0]
+
+def bench_object(object, queries, repeat):
+    res = {}
+    rng = random.Random(42)
+    mt = MeshTools(object)
+    res["faces"] = len(mt.mesh.faces)
+    res["edges"] = len(mt.mesh.edges)
+    lo,hi = bounds(mt)
+    points = [ Vector([rng.uniform(lo.x, hi.x), rng.uniform(lo.y, hi.y), 0.05]) for _ in range(queries) ]
+    ## In object mode a refresh only reads the array view, and hover queries
+    ## are served from it until something needs the bmesh.
+    res["refresh"] = timed(lambda: mt.refresh(full=True), repeat)
+    mt.view.index('edges').wait()
+    res["closest_edge_view"] = timed(lambda: [ mt.closest_edge(p) for p in points ], repeat) / queries
+    mt.mesh
+    mt.ensure_index('faces', wait=True)
+    mt.ensure_index('edges', wait=True)
+    res["closest_edge"] = timed(lambda: [ mt.closest_edge(p) for p in points ], repeat) / queries
+    e = boundary_edge(mt)
+    far = Vector([hi.x * 0.75, lo.y, 0.0])
+    res["closest_connected_edge"] = timed(lambda: mt.closest_connected_edge(e, far), repeat)
+    row = sorted((v for v in mt.mesh.verts if v.co.y == lo.y), key=lambda v: v.co.x)
+    a,b = row[0], row[len(row)*3//4]
+    res["edge_path"] = timed(lambda: mt.edge_path(a, b, restrict=True), repeat)
+    res["edge_path_unrestricted"] = timed(lambda: mt.edge_path(a, b), repeat)
+    ## Rectangles modify the mesh, so these are only measured once each.
+    bottom = [ e for e in mt.mesh.edges if e.is_boundary and e.verts[0].co.y == lo.y and e.verts[1].co.y == lo.y ]
+    bottom.sort(key=lambda e: e.verts[0].co.x)
+    bottom = bottom[::max(1, len(bottom)//queries)][:queries]
+    t = time.perf_counter()
+    for e in bottom:
+        mt.create_rect(e, e.verts[0].co.copy(), e.verts[1].co + Vector([0.0, -0.1, 0.0]))
+    res["create_rect"] = (time.perf_counter() - t) / max(1, len(bottom))
+    res["sync"] = timed(lambda: mt.sync(force=True))
+    mt.free()
+    return res
+
+def run(args):
+    results = {}
+    for shape in args.shapes:
+        results[shape] = {}
+        for size in args.sizes:
+            object = quad_mesh(f"bench-{shape}-{size}", shapes[shape](size))
+            print(f"Benchmarking {shape} {size}...", flush=True)
+            results[shape][str(size)] = bench_object(object, args.queries, args.repeat)
+            mesh = object.data
+            bpy.data.objects.remove(object)
+            bpy.data.meshes.remove(mesh)
+    return {
+        "blender": bpy.app.version_string,
+        "timestamp": time.time(),
+        "results": results,
+    }
+
+def compare(current, baseline, tolerance):
+    regressions = []
+    for shape, sizes in current["results"].items():
+        for size, ops in sizes.items():
+            base = baseline.get("results", {}).get(shape, {}).get(size)
+            if base is None:
+                continue
+            for op, t in ops.items():
+                if op in ("faces", "edges") or op not in base or base[op] <= 0.0:
+                    continue
+                ratio = t / base[op]
+                status = "REGRESSION" if 1.0 + tolerance < ratio else "ok"
+                print(f"{shape:>6} {size:>8} {op:>24} {base[op]:12.6f} {t:12.6f} {ratio:6.2f}x {status}")
+                if status != "ok":
+                    regressions.append((shape, size, op, ratio))
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="mesh_bench", description="Benchmark the Rectangle Tools mesh hot paths.")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000",
+                        type=lambda s: [int(x) for x in s.split(",")])
+    parser.add_argument("--shapes", default="grid,strip,city",
+                        type=lambda s: [x for x in s.split(",") if x in shapes])
+    parser.add_argument("--queries", default=100, type=int)
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", default=0.2, type=float,
+                        help="Allowed slowdown relative to the baseline before failing")
+    args = parser.parse_args(argv)
+    current = run(args)
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"Wrote {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[sys.argv.index("--")+1:] if "--" in sys.argv else [])
@@ -0,0 +1,13 @@
+import importlib.util
+import os
+import sys
+
+## The add-on's __init__ imports bpy, but the modules under test only depend
+## on NumPy. Register the package without running its __init__, so that
+## they can be imported, relative imports and all, outside of Blender.
+name = "SHIRAKUMO_rectangle_tools"
+path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "addons", name)
+if name not in sys.modules:
+    spec = importlib.util.spec_from_loader(name, loader=None, is_package=True)
+    spec.submodule_search_locations = [path]
+    sys.modules[name] = importlib.util.module_from_spec(spec)
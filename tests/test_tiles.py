@@ -0,0 +1,44 @@
+import numpy as np
+from SHIRAKUMO_rectangle_tools.tiles import greedy_rects, rect_outlines
+
+def coverage(rects, shape):
+    covered = np.zeros(shape, dtype=np.int64)
+    for x,y,w,h in rects:
+        covered[y:y+h, x:x+w] += 1
+    return covered
+
+def test_greedy_rects_full():
+    assert greedy_rects(np.ones((4,3), dtype=bool)) == [(0, 0, 3, 4)]
+
+def test_greedy_rects_empty():
+    assert greedy_rects(np.zeros((3,3), dtype=bool)) == []
+
+def test_greedy_rects_covers_exactly():
+    tiles = np.random.default_rng(1).random((20,30)) < 0.6
+    covered = coverage(greedy_rects(tiles), tiles.shape)
+    np.testing.assert_array_equal(covered, tiles.astype(np.int64))
+
+def test_greedy_rects_merges_across_rows():
+    ## The left half is full, and every other row is full on the right.
+    tiles = np.zeros((10,10), dtype=bool)
+    tiles[:,:5] = True
+    tiles[::2,5:] = True
+    rects = greedy_rects(tiles)
+    assert len(rects) == 6
+    np.testing.assert_array_equal(coverage(rects, tiles.shape), tiles.astype(np.int64))
+
+def test_rect_outlines_single():
+    points, outlines = rect_outlines([(0, 0, 2, 1)])
+    assert points.tolist() == [[0,0], [2,0], [0,1], [2,1]]
+    ## Counter-clockwise from the bottom left.
+    assert outlines == [[0, 1, 3, 2]]
+
+def test_rect_outlines_shares_seams():
+    ## A wide rectangle below two narrow ones, which puts a vertex in the
+    ## middle of the wide one's top edge.
+    points, outlines = rect_outlines([(0, 0, 2, 1), (0, 1, 1, 1), (1, 1, 1, 1)])
+    assert len(points) == 8
+    points = [ tuple(p) for p in points.tolist() ]
+    assert [ points[i] for i in outlines[0] ] == [(0,0), (2,0), (2,1), (1,1), (0,1)]
+    assert [ points[i] for i in outlines[1] ] == [(0,1), (1,1), (1,2), (0,2)]
+    assert [ points[i] for i in outlines[2] ] == [(1,1), (2,1), (2,2), (1,2)]
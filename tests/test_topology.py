@@ -0,0 +1,185 @@
+import numpy as np
+from SHIRAKUMO_rectangle_tools.topology import Topology
+
+def strip(n, length=1.0):
+    ## N collinear edges along X, each LENGTH long.
+    co = [ (i*length, 0.0, 0.0) for i in range(n+1) ]
+    edges = [ (i, i+1) for i in range(n) ]
+    return Topology(co, edges)
+
+def square():
+    ## A unit square whose bottom side is split in two.
+    co = [(0,0,0), (0.5,0,0), (1,0,0), (1,1,0), (0,1,0)]
+    edges = [(0,1), (1,2), (2,3), (3,4), (4,0)]
+    return Topology(co, edges)
+
+def test_link_edges():
+    t = square()
+    assert sorted(t.link_edges(0)) == [0, 4]
+    assert sorted(t.link_edges(1)) == [0, 1]
+    assert t.other_vert(2, 2) == 3
+
+def test_closest_connected_edge_within():
+    t = strip(4)
+    assert t.closest_connected_edge(1, (1.5, 0.2, 0.0)) == 1
+
+def test_closest_connected_edge_walks():
+    t = strip(4)
+    assert t.closest_connected_edge(0, (3.5, 0.0, 0.0)) == 3
+    assert t.closest_connected_edge(3, (0.25, 1.0, 0.0)) == 0
+
+def test_closest_connected_edge_past_end():
+    t = strip(4)
+    assert t.closest_connected_edge(1, (10.0, 0.0, 0.0)) == 3
+    assert t.closest_connected_edge(2, (-10.0, 0.0, 0.0)) == 0
+
+def test_closest_connected_edge_around_corner():
+    t = square()
+    ## There are no collinear edges past the corner, so we stay on the side.
+    assert t.closest_connected_edge(0, (2.0, 0.0, 0.0)) == 1
+
+def test_edge_path():
+    t = square()
+    ## Ordered from the end to the start.
+    assert t.edge_path(1, 3) == [2, 1]
+    assert t.edge_path(1, 4) == [4, 0]
+    assert t.edge_path(0, 0) == []
+
+def test_edge_path_restricted():
+    t = square()
+    assert t.edge_path(0, 2, restrict=True) == [1, 0]
+    ## The only way to the top goes outside of the segment's bounds.
+    assert t.edge_path(0, 3, restrict=True) is None
+
+def test_edge_path_disconnected():
+    t = Topology([(0,0,0), (1,0,0), (5,0,0), (6,0,0)], [(0,1), (2,3)])
+    assert t.edge_path(0, 3) is None
+
+def test_split_edge():
+    ## Split edge 1 of a strip at x=1.5, like bmesh.utils.edge_split does,
+    ## keeping the first half in the old edge.
+    t = strip(3)
+    t.chain(0)
+    v = t.add_vertex((1.5, 0.0, 0.0))
+    e = t.add_edge(v, 2)
+    t.set_edge(1, 1, v)
+    assert t.closest_connected_edge(0, (1.75, 0.0, 0.0)) == e
+    assert t.closest_connected_edge(0, (1.25, 0.0, 0.0)) == 1
+    assert t.edge_path(0, 3, restrict=True) == [2, e, 1, 0]
+
+def test_compact():
+    t = Topology([(0,0,0), (1,0,0)], [(0,1)], churn=0.0)
+    rebuilds = t.rebuilds
+    v = t.add_vertex((2,0,0))
+    e = t.add_edge(1, v)
+    assert rebuilds < t.rebuilds
+    assert not t.overrides
+    assert sorted(t.link_edges(1)) == [0, e]
+    np.testing.assert_array_equal(t.co[v], (2,0,0))
+
+def test_chain():
+    t = strip(4)
+    chain = t.chain(2)
+    assert chain.edges == [0, 1, 2, 3]
+    assert chain.verts == [0, 1, 2, 3, 4]
+    assert chain.ts == [-2.0, -1.0, 0.0, 1.0, 2.0]
+    assert all(t.chains[e] is chain for e in chain.edges)
+    assert t.chain(0) is chain
+
+def test_chain_stops_at_bend():
+    t = square()
+    assert t.chain(0).edges == [0, 1]
+    assert t.chain(2).edges == [2]
+
+def test_chain_stops_at_fork():
+    ## Two edges continue straight on from vert 1, so neither is part of it.
+    t = Topology([(0,0,0), (1,0,0), (2,0,0), (2,0.0001,0)], [(0,1), (1,2), (1,3)])
+    assert t.chain(0).edges == [0]
+
+def test_chain_split():
+    t = strip(3)
+    chain = t.chain(0)
+    v = t.add_vertex((1.5, 0.0, 0.0))
+    e = t.add_edge(v, 2)
+    t.set_edge(1, 1, v)
+    assert t.chains[e] is chain
+    assert chain.edges == [0, 1, e, 2]
+    assert chain.verts == [0, 1, v, 2, 3]
+    assert chain.ts == [0.0, 1.0, 1.5, 2.0, 3.0]
+    assert t.vert_chains[v] == [chain]
+
+def test_chain_split_off_line():
+    ## A vertex that is not on the line makes the edges bend, so the chain
+    ## can't be kept.
+    t = strip(3)
+    chain = t.chain(0)
+    v = t.add_vertex((1.5, 0.5, 0.0))
+    e = t.add_edge(v, 2)
+    t.set_edge(1, 1, v)
+    assert 0 not in t.chains and e not in t.chains
+    assert t.chain(0) is not chain
+    assert t.chain(0).edges == [0]
+
+def test_chain_moved_vertex():
+    t = strip(3)
+    chain = t.chain(0)
+    t.set_co(3, (3.0, 0.0, 0.0))
+    assert t.chains[0] is chain
+    t.set_co(3, (3.0, 1.0, 0.0))
+    assert 0 not in t.chains and 3 not in t.vert_chains
+    assert t.chain(0).edges == [0, 1]
+    ## Past the chain the walk still follows edges that bend a little.
+    assert t.closest_connected_edge(0, (2.5, 0.0, 0.0)) == 2
+
+def replay(t, co, edges, created, touched):
+    ## Brings T up to date with a mesh of CO and EDGES after an edit that
+    ## created and touched the given verts, like MeshTools.commit_topology.
+    touched = set(touched) | set(created)
+    touched |= set(b if a == v else a for v in list(touched) for a,b in edges if v in (a,b))
+    linked = [ i for i,(a,b) in enumerate(edges) if a in touched or b in touched ]
+    ne = t.ne
+    for v in sorted(created):
+        t.add_vertex(co[v])
+    for v in touched:
+        t.set_co(v, co[v])
+    for e in linked:
+        if ne <= e:
+            t.add_edge(*edges[e])
+    for e in linked:
+        if e < ne:
+            t.set_edge(e, *edges[e])
+
+def test_replayed_edits():
+    ## Two rectangles drawn off a strip, each splitting an edge of it the
+    ## way bmesh.utils.edge_split does, with the kernel brought up to date
+    ## mid rectangle and on commit like in MeshTools.
+    co = [(0,0,0), (1,0,0), (2,0,0), (3,0,0)]
+    edges = [(0,1), (1,2), (2,3)]
+    t = Topology(co, edges)
+    chain = t.chain(0)
+    ## Split edge 1 at x=1.5, then build the quad up to y=1 on its first half.
+    co.append((1.5,0,0))
+    edges[1] = (1,4)
+    edges.append((4,2))
+    replay(t, co, edges, [4], [])
+    co += [(1,1,0), (1.5,1,0)]
+    edges += [(4,6), (6,5), (5,1)]
+    replay(t, co, edges, [5,6], [1,4])
+    ## Split the second half again at x=1.75.
+    co.append((1.75,0,0))
+    edges[3] = (4,7)
+    edges.append((7,2))
+    replay(t, co, edges, [7], [])
+    assert t.chains[0] is chain
+    assert chain.edges == [0, 1, 3, 7, 2]
+    assert chain.verts == [0, 1, 4, 7, 2, 3]
+    ## The kernel answers like one built from scratch.
+    fresh = Topology(co, edges)
+    np.testing.assert_array_equal(t.co[:t.nv], fresh.co)
+    np.testing.assert_array_equal(t.edges[:t.ne], fresh.edges)
+    for v in range(len(co)):
+        assert sorted(t.link_edges(v)) == sorted(fresh.link_edges(v))
+    for x in (-1.0, 0.5, 1.25, 1.6, 1.9, 2.5, 4.0):
+        assert t.closest_connected_edge(0, (x,0,0)) == fresh.closest_connected_edge(0, (x,0,0))
+    assert t.edge_path(0, 3, restrict=True) == fresh.edge_path(0, 3, restrict=True)
+    assert t.edge_path(5, 3) == fresh.edge_path(5, 3)